@@ -1,4 +1,49 @@
-from view import App
-from model import Model
+import argparse
+from profiling import profiler
 
-App(Model()).mainloop()
+parser = argparse.ArgumentParser(prog="app-installer")
+parser.add_argument("--rebuild-index", action="store_true", help="rescan every icon directory and rewrite the icon index")
+parser.add_argument("--manifest", metavar="APPS.toml", help="install every [[app]] of a toml manifest without opening the window")
+parser.add_argument("--jobs", type=int, default=4, help="maximum number of apps installed at once with --manifest (default: 4)")
+parser.add_argument("--daemon", action="store_true", help="serve the system-wide icon index to every user on $APP_INSTALLER_SOCKET (default: /run/app-installer/icons.sock)")
+parser.add_argument("--profile", metavar="TRACE.json", nargs="?", const="app-installer-trace.json",
+                    help="record timings and counters and write them as a Chrome trace on exit (also enabled by $APP_INSTALLER_PROFILE)")
+parser.add_argument("--startup-time", action="store_true", help="print the milliseconds from the interpreter start to the first painted frame and exit")
+args = parser.parse_args()
+
+if args.profile:
+    profiler.enable(args.profile)
+
+if args.rebuild_index:
+    from model import icon_index
+    print(f"{len(icon_index().rebuild())} icons indexed")
+elif args.daemon:
+    from icon_daemon import serve
+    serve()
+elif args.manifest:
+    from manifest import run_manifest
+    raise SystemExit(run_manifest(args.manifest, args.jobs))
+else:
+    from model import Model
+
+    # the model starts gsettings and the icon index in a background thread,
+    # they run while customtkinter is imported and the window is built
+    model = Model()
+    from view import App
+
+    app = App(model)
+
+    def on_expose(event):
+        # the window is mapped and exposed, its widgets are drawn by the idle tasks already queued
+        if event.widget is app:
+            app.unbind("<Expose>", expose_id)
+            app.after_idle(on_first_frame)
+
+    def on_first_frame():
+        profiler.mark("startup.first_frame")
+        if args.startup_time:
+            print(f"{profiler.elapsed_ms():.1f}")
+            app.destroy()
+
+    expose_id = app.bind("<Expose>", on_expose, add=True)
+    app.mainloop()
@@ -0,0 +1,325 @@
+"""
+Benchmarks of the hot paths on synthetic icon trees.
+
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python benchmark.py --sizes 10000 --compare bench.json
+
+Thumbnails are skipped without cairosvg, widgets without customtkinter or a display (run it under xvfb-run).
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import shutil
+import argparse
+import importlib.util
+import platform
+import statistics
+import subprocess
+import tempfile
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from icon_index import IconIndex
+from icon_theme import IconTheme
+from icon_search import IconTable, FuzzyIndex
+from thumbnails import ThumbnailCache
+
+WORDS = ["code", "visual", "studio", "firefox", "gnome", "app", "org", "kde", "terminal", "text", "editor",
+         "media", "player", "system", "settings", "x", "libre", "office", "calc", "writer", "steam", "game"]
+SIZES = [16, 24, 32, 48, 64, 128, 256]
+SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{0}"><circle cx="{1}" cy="{1}" r="{1}" fill="#1F6AA5"/></svg>'
+
+
+def png(size: int) -> bytes:
+    """
+    :returns: a valid, plain blue size x size png
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\0" + b"\x1f\x6a\xa5" * size for _ in range(size))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def generate_tree(root: str, count: int, seed: int = 0) -> tuple[list[str], str]:
+    """
+    Creates a theme inheriting from hicolor in root/icons and a nested pixmaps directory,
+    with count icon files in total, 2/3 png and 1/3 svg
+    :returns: the base dirs of the themes and the pixmaps directory
+    """
+    rng = random.Random(seed)
+    base, pixmaps = os.path.join(root, "icons"), os.path.join(root, "pixmaps")
+    pngs = {size: png(size) for size in SIZES}
+    for theme, inherits in (("Bench", "hicolor"), ("hicolor", "")):
+        subdirs = [f"apps/{size}" for size in SIZES] + ["apps/scalable"]
+        os.makedirs(os.path.join(base, theme), exist_ok=True)
+        with open(os.path.join(base, theme, "index.theme"), "w") as f:
+            f.write(f"[Icon Theme]\nName={theme}\nInherits={inherits}\nDirectories={','.join(subdirs)}\n\n")
+            for size in SIZES:
+                f.write(f"[apps/{size}]\nSize={size}\nContext=Applications\nType=Fixed\n\n")
+            f.write("[apps/scalable]\nSize=64\nMinSize=8\nMaxSize=512\nContext=Applications\nType=Scalable\n")
+        for subdir in subdirs:
+            os.makedirs(os.path.join(base, theme, subdir), exist_ok=True)
+
+    names: set[str] = set()
+    while len(names) < count:
+        names.add("-".join(rng.choices(WORDS, k=rng.randint(1, 3))) + str(rng.randint(0, 99999)))
+    for name in names:
+        where = rng.random()
+        if where < 0.15:
+            directory = os.path.join(pixmaps, *rng.choices("abc", k=rng.randint(0, 2)))
+        else:
+            theme = "Bench" if where < 0.75 else "hicolor"
+            directory = os.path.join(base, theme, "apps", "scalable" if rng.random() < 1 / 3 else str(rng.choice(SIZES)))
+        os.makedirs(directory, exist_ok=True)
+        if directory.endswith("scalable"):
+            with open(os.path.join(directory, name + ".svg"), "w") as f:
+                f.write(SVG.format(64, 32))
+        else:
+            with open(os.path.join(directory, name + ".png"), "wb") as f:
+                f.write(pngs[int(os.path.basename(directory))] if os.path.basename(directory).isdigit() else pngs[48])
+    return [base], pixmaps
+
+
+def timed(function: Callable[[], object]) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "p50_ms": samples[len(samples) // 2],
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "mean_ms": statistics.fmean(samples),
+    }
+
+
+def keystrokes(names: list[str], rng: random.Random, words: int = 40) -> list[str]:
+    """
+    :returns: the successive contents of the search bar while typing words taken from names and from WORDS
+    """
+    queries: list[str] = []
+    for word in rng.sample(names, words // 2) + rng.choices(WORDS, k=words - words // 2):
+        queries += [word[:i] for i in range(1, min(len(word), 10) + 1)]
+    return queries
+
+
+def import_ms(module: str) -> float:
+    """
+    :returns: the time taken to import module in a fresh interpreter
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stderr
+    return int(stderr.strip().splitlines()[-1].split("|")[1]) / 1000
+
+
+def bench_imports(runs: int = 10) -> dict:
+    """
+    Import time of what is loaded before the window shows up and time to its first frame, the median of runs fresh interpreters
+    """
+    results = {"model": {"median_ms": statistics.median(import_ms("model") for _ in range(runs))}}
+    if importlib.util.find_spec("customtkinter") is None:
+        results["view"] = {"skipped": "customtkinter is not installed"}
+    else:
+        results["view"] = {"median_ms": statistics.median(import_ms("view") for _ in range(runs))}
+    results["first_frame"] = bench_first_frame(runs)
+    return results
+
+
+def bench_first_frame(runs: int = 10) -> dict:
+    """
+    Time from the interpreter start to the first painted frame of the window, the 400 ms target of the README
+    """
+    if importlib.util.find_spec("customtkinter") is None:
+        return {"skipped": "customtkinter is not installed"}
+    if not os.environ.get("DISPLAY"):
+        return {"skipped": "no display"}
+    samples: list[float] = []
+    for _ in range(runs):
+        stdout = subprocess.run([sys.executable, os.path.dirname(os.path.abspath(__file__)), "--startup-time"],
+                                capture_output=True, text=True, timeout=60, check=True).stdout
+        samples.append(float(stdout.strip().splitlines()[-1]))
+    return {"median_ms": statistics.median(samples)}
+
+
+def bench_startup(base_dirs: list[str], pixmaps: str, index_file: str) -> tuple[dict, dict[str, str]]:
+    def load() -> dict[str, str]:
+        theme = IconTheme("Bench", base_dirs, pixmaps)
+        return IconIndex(theme.roots(), index_file, theme.rank(32)).load()
+
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    cold_ms, icons = timed(load)
+    warm_ms, _ = timed(load)
+    search_ms, _ = timed(lambda: FuzzyIndex(IconTable(icons)))
+    return {"cold_ms": cold_ms, "warm_ms": warm_ms, "search_index_ms": search_ms, "icons": len(icons),
+            "index_bytes": os.path.getsize(index_file)}, icons
+
+
+def bench_search(icons: dict[str, str], rng: random.Random) -> dict:
+    queries = keystrokes(list(icons), rng)
+    prefix = IconTable(icons)
+    fuzzy = FuzzyIndex(prefix)
+    return {
+        "keystrokes": len(queries),
+        "prefix": percentiles([timed(lambda: prefix.search(query))[0] for query in queries]),
+        "fuzzy_top50": percentiles([timed(lambda: fuzzy.search(query, 50))[0] for query in queries]),
+        "fuzzy_top500": percentiles([timed(lambda: fuzzy.search(query, 500))[0] for query in queries]),
+        # the worst case: every tier scans all the names, the reversed queries rarely match
+        "fuzzy_no_match": percentiles([timed(lambda: fuzzy.search(query[::-1] + query, 500))[0] for query in queries]),
+    }
+
+
+def bench_memory(icons: dict[str, str]) -> dict:
+    """
+    Bytes per icon of the icon indexes, summed with sys.getsizeof over their structures.
+    The name strings are left out since every structure shares them
+    """
+    names = list(icons)
+    table = IconTable(icons)
+    prefixes = sorted({name[:2] for name in names})[:50]
+    # what the prefix search cache holds: the pairs and their lists, or the views
+    pairs = [list(table.search(prefix)) for prefix in prefixes]
+    views = [table.search(prefix) for prefix in prefixes]
+    results = sum(map(len, pairs))
+    return {
+        "dict_bytes_per_icon": (sys.getsizeof(icons) + sum(map(sys.getsizeof, icons.values()))) / len(names),
+        "table_bytes_per_icon": table.nbytes() / len(names),
+        "fuzzy_bytes_per_icon": FuzzyIndex(table).nbytes() / len(names),
+        # the paths of the pairs are built by the table, one string per result
+        "prefix_list_bytes_per_result": sum(sys.getsizeof(result) + sum(sys.getsizeof(pair) + sys.getsizeof(pair[1]) for pair in result)
+                                            for result in pairs) / results,
+        "prefix_view_bytes_per_result": sum(view.nbytes() for view in views) / results,
+    }
+
+
+def bench_thumbnails(icons: dict[str, str], root: str, count: int = 200) -> dict:
+    try:
+        import cairosvg  # noqa: F401
+    except ImportError:
+        return {"skipped": "cairosvg is not installed"}
+    svgs = [path for path in icons.values() if path.endswith(".svg")][:count]
+    thumbnails = ThumbnailCache(os.path.join(root, "thumbnails"))
+    try:
+        cold_ms, _ = timed(lambda: thumbnails.get_many(svgs, 32))
+        warm_ms, _ = timed(lambda: thumbnails.get_many(svgs, 32))
+    finally:
+        thumbnails.close()
+    return {"svgs": len(svgs), "workers": thumbnails.workers, "cold_ms": cold_ms, "warm_ms": warm_ms,
+            "svgs_per_second": len(svgs) / cold_ms * 1000 if cold_ms else 0}
+
+
+class BenchModel:
+    """
+    The part of Model the icon browser uses, over the synthetic icons
+    """
+    def __init__(self, icons: dict[str, str], root: str):
+        self._fuzzy = FuzzyIndex(icons)
+        self._thumbnails = ThumbnailCache(os.path.join(root, "thumbnails"))
+
+    def fuzzy_search_icon(self, name: str, limit: int = 50) -> list[tuple[str, str, float]]:
+        return self._fuzzy.search(name, limit)
+
+    def get_png(self, path: str, size: int = 32) -> str:
+        return self._thumbnails.get(path, size)
+
+    def get_pngs(self, paths: list[str], size: int = 32) -> list[str]:
+        return self._thumbnails.get_many(paths, size)
+
+    def is_indexing(self) -> bool:
+        return False
+
+    def icon_count(self) -> int:
+        return len(self._fuzzy)
+
+
+def bench_widgets(icons: dict[str, str], root: str, rng: random.Random) -> dict:
+    if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+        return {"skipped": "no display, run the benchmark under xvfb-run"}
+    try:
+        import customtkinter as ctk
+        from view import IconTopLevel
+    except ImportError as e:
+        return {"skipped": f"{e.name} is not installed"}
+    # only the png icons: rasterization is measured by bench_thumbnails
+    model = BenchModel({name: path for name, path in icons.items() if path.endswith(".png")}, root)
+    app = ctk.CTk()
+    try:
+        open_ms, browser = timed(lambda: IconTopLevel(model, app))
+        app.update()
+        samples = []
+        for query in keystrokes(list(icons), rng, words=10):
+            results = model.fuzzy_search_icon(query, IconTopLevel.max_results)
+            samples.append(timed(lambda: (browser.show_results(query, results), app.update_idletasks()))[0])
+        return {"open_ms": open_ms, "render": percentiles(samples), "rows": len(browser.rows)}
+    finally:
+        app.destroy()
+
+
+def git_commit() -> str:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+
+
+def compare(old: dict, new: dict, path: str = ""):
+    """
+    Prints the ratio new/old of every timing present in both results
+    """
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            compare(old[key], value, f"{path}{key}.")
+        elif key.endswith("_ms") and isinstance(old.get(key), (int, float)) and old[key]:
+            print(f"{path + key:<48} {old[key]:10.2f} -> {value:10.2f} ms  x{value / old[key]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks the icon index, search, thumbnails and icon browser")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="icon counts of the synthetic trees")
+    parser.add_argument("--output", help="where the json results are written, stdout by default")
+    parser.add_argument("--compare", metavar="RESULTS.json", help="previous results to compare with")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+               "cpus": os.cpu_count(), "imports": bench_imports(), "sizes": {}}
+    for count in args.sizes:
+        root = tempfile.mkdtemp(prefix=f"icon-bench-{count}-")
+        try:
+            rng = random.Random(args.seed)
+            print(f"generating {count} icons in {root}", file=sys.stderr)
+            generate_ms, (base_dirs, pixmaps) = timed(lambda: generate_tree(root, count, args.seed))
+            startup, icons = bench_startup(base_dirs, pixmaps, os.path.join(root, "icon-index.json"))
+            results["sizes"][str(count)] = {
+                "generate_ms": generate_ms,
+                "startup": startup,
+                "search": bench_search(icons, rng),
+                "memory": bench_memory(icons),
+                "thumbnails": bench_thumbnails(icons, root),
+                "widgets": bench_widgets(icons, root, rng),
+            }
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"{old.get('commit', '?')} -> {results['commit']}", file=sys.stderr)
+        compare(old.get("imports", {}), results["imports"], "imports.")
+        compare(old.get("sizes", {}), results["sizes"])
+
+
+if __name__ == "__main__":
+    main()
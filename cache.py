@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Dict-like cache that evicts the least recently used entries once it holds more than maxsize entries,
+    or once the summed weight of its values exceeds max_weight.
+    Safe to share between threads.
+    """
+    def __init__(self, maxsize: int = 128, max_weight: int | None = None, weigh: Callable[[V], int] | None = None):
+        """
+        :param max_weight: budget of the cache, in the unit returned by weigh (usually bytes)
+        :param weigh: returns the weight of a value, required with max_weight
+        """
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self.weight: int = 0
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._weights: dict[K, int] = {}
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key: K, value: V):
+        with self._lock:
+            self.weight -= self._weights.pop(key, 0)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self._weigh is not None:
+                self._weights[key] = self._weigh(value)
+                self.weight += self._weights[key]
+            while len(self._data) > self.maxsize or (self.max_weight is not None and self.weight > self.max_weight and len(self._data) > 1):
+                evicted, _ = self._data.popitem(last=False)
+                self.weight -= self._weights.pop(evicted, 0)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import heapq
+import socket
+import pathlib
+import threading
+import socketserver
+from typing import Any, Callable, Self, Sequence
+from icon_index import IconIndex, cache_dir
+from icon_theme import IconTheme, system_dirs, system_themes
+from icon_search import IconTable, FuzzyIndex
+from icon_watcher import IconWatcher
+from cache import LRUCache
+from thumbnails import ThumbnailCache
+
+MAX_REQUEST: int = 1024 * 1024
+_THEME_NAME = re.compile(r"[^/\0]*")
+
+
+def socket_path() -> str:
+    """
+    :returns: the socket of the icon daemon, $APP_INSTALLER_SOCKET or /run/app-installer/icons.sock
+    """
+    return os.environ.get("APP_INSTALLER_SOCKET") or "/run/app-installer/icons.sock"
+
+
+class DaemonError(Exception):
+    """
+    The icon daemon rejected a request or failed to answer it, it is still running
+    """
+
+
+class IconServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    System-wide icon index shared by every user of the machine, served on a unix socket.
+    It indexes the themes of the system data directories and /usr/share/pixmaps once for everybody,
+    answers batches of prefix and fuzzy queries and rasterizes the system svgs in a shared thumbnail cache.
+    The icons of the users (~/.icons, ~/.local/share/icons) are left to Model.
+
+    The protocol is one json object per line in each direction, requests are
+    {"op": "prefix" | "fuzzy" | "paths" | "count" | "thumbnails", "theme": name, "size": pixels, ...}
+    and answers {"results": [...]} or {"error": message}
+    """
+    daemon_threads: bool = True
+    max_size: int = 1024
+    # tables of the most requested (theme, size) pairs, about 50 bytes per icon each
+    max_tables: int = 16
+
+    def __init__(self, path: str | None = None, cache: str | os.PathLike | None = None, themes: list[str] | None = None):
+        """
+        :param path: path of the socket, defaults to socket_path()
+        :param cache: directory of the indexes and thumbnails, defaults to /var/cache/app-installer
+         when running as root and to the cache of the user otherwise
+        :param themes: themes indexed before listening, defaults to every theme of the system data directories.
+         The others are indexed on their first request
+        """
+        self.path = path or socket_path()
+        if cache is None:
+            cache = "/var/cache/app-installer" if os.geteuid() == 0 else cache_dir() / "daemon"
+        self.cache = pathlib.Path(cache)
+        self._themes: dict[str, tuple[IconTheme, IconIndex]] = {}
+        self._tables: LRUCache[tuple[str, int], tuple[IconTable, FuzzyIndex]] = LRUCache(maxsize=self.max_tables)
+        self._directories: set[str] = set()
+        # guards the directories, the indexes are built and refreshed under _index_lock so that
+        # the requests on the indexed themes are answered meanwhile
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._thumbnails = ThumbnailCache(self.cache / "thumbnails", max_bytes=256 * 1024 * 1024)
+        self._watcher = IconWatcher(self._on_icon_dirs_changed)
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path):
+            client = IconClient.connect(self.path)
+            if client is not None:
+                client.close()
+                raise OSError(f"an icon daemon is already listening on '{self.path}'")
+            os.remove(self.path)
+        self._watcher.start([])
+        # the clients index everything in-process until the daemon listens, rather than time out on a crawl
+        for theme_name in system_themes() if themes is None else themes:
+            self._table(theme_name, 32)
+        super().__init__(self.path, _RequestHandler)
+        # every user of the machine may query it
+        os.chmod(self.path, 0o666)
+
+    def server_close(self):
+        super().server_close()
+        self._watcher.stop()
+        self._thumbnails.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def answer(self, request: dict) -> Any:
+        """
+        :returns: the results of a request, see the protocol in the class docstring
+        Raises a ValueError, KeyError or TypeError if the request is invalid
+        """
+        op = request["op"]
+        if op == "thumbnails":
+            return self._thumbnails_of(request["paths"], self._size(request))
+        table, fuzzy = self._table(request["theme"], self._size(request))
+        with self._lock:
+            if op == "prefix":
+                limit = request.get("limit")
+                return [list(table.search(query)[:limit]) for query in self._strings(request["queries"])]
+            if op == "fuzzy":
+                return [fuzzy.search(query, int(request.get("limit", 50))) for query in self._strings(request["queries"])]
+            if op == "paths":
+                return [table.get(name) for name in self._strings(request["names"])]
+            if op == "count":
+                return len(table)
+        raise ValueError(f"unknown operation {op!r}")
+
+    def _size(self, request: dict) -> int:
+        size = int(request.get("size", 32))
+        if not 0 < size <= self.max_size:
+            raise ValueError(f"invalid size {size}")
+        return size
+
+    @staticmethod
+    def _strings(values: Sequence) -> list[str]:
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise TypeError("expected a list of strings")
+        return values
+
+    def _table(self, theme_name: str, size: int) -> tuple[IconTable, FuzzyIndex]:
+        if not isinstance(theme_name, str) or not _THEME_NAME.fullmatch(theme_name) or theme_name in (".", ".."):
+            raise ValueError(f"invalid theme {theme_name!r}")
+        if not any(os.path.isfile(os.path.join(d, theme_name, "index.theme")) for d in system_dirs()):
+            # not installed system-wide, only hicolor and the pixmaps apply. Any name would be indexed otherwise
+            theme_name = "hicolor"
+        tables = self._tables.get((theme_name, size))
+        if tables is not None:
+            return tables
+        with self._index_lock:
+            if theme_name not in self._themes:
+                theme = IconTheme(theme_name, system_dirs())
+                index = IconIndex(theme.roots(), self.cache / f"icon-index-{theme_name}.json", theme.rank(size))
+                index.load()
+                self._themes[theme_name] = (theme, index)
+                self._watcher.watch(index.directories())
+                with self._lock:
+                    self._directories.update(index.directories())
+            tables = self._tables.get((theme_name, size))
+            if tables is None:
+                theme, index = self._themes[theme_name]
+                table = IconTable(index.to_dict(theme.rank(size)))
+                tables = self._tables[(theme_name, size)] = (table, FuzzyIndex(table))
+            return tables
+
+    def _thumbnails_of(self, paths: list[str], size: int) -> list[str | None]:
+        """
+        :returns: the thumbnail of each path, None for the files that aren't in a system icon directory
+        """
+        paths = self._strings(paths)
+        with self._lock:
+            # only indexed icons are rendered, not any file a client asks for
+            shared = [path for path in paths if os.path.dirname(path) in self._directories]
+        pngs = dict(zip(shared, self._thumbnails.get_many(shared, size)))
+        return [pngs.get(path) for path in paths]
+
+    def _on_icon_dirs_changed(self, changed: set[str] | None):
+        with self._index_lock:
+            for _, index in self._themes.values():
+                added, removed = index.refresh(changed)
+                self._watcher.watch(index.directories())
+                with self._lock:
+                    self._directories.update(index.directories())
+                if added or removed:
+                    # the system icons rarely change, every table is rebuilt on its next request
+                    self._tables.clear()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: IconServer
+
+    def handle(self):
+        while line := self.rfile.readline(MAX_REQUEST):
+            if not line.endswith(b"\n"):
+                return
+            try:
+                response = {"results": self.server.answer(json.loads(line))}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": f"invalid request: {e}"}
+            except Exception as e:
+                print(f"ERROR: {type(e).__name__}: {e}")
+                response = {"error": str(e)}
+            try:
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+            except BrokenPipeError:
+                # the client gave up waiting
+                return
+
+
+class IconClient:
+    """
+    Connection to the icon daemon, see IconServer. Requests are serialized, a client can be shared between threads.
+    Every method may raise an OSError if the daemon went away, or a DaemonError, also when it didn't answer within timeout
+    """
+    def __init__(self, path: str | None = None, timeout: float = 5.0):
+        self.path = path or socket_path()
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        try:
+            self._socket.connect(self.path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile("rwb")
+
+    @classmethod
+    def connect(cls, path: str | None = None) -> Self | None:
+        """
+        :returns: a client, None if the daemon isn't running
+        """
+        try:
+            return cls(path)
+        except OSError:
+            return None
+
+    def close(self):
+        try:
+            self._file.close()
+        except OSError:
+            # unflushed request of a daemon that went away
+            pass
+        self._socket.close()
+
+    def request(self, op: str, **args) -> Any:
+        with self._lock:
+            try:
+                self._file.write(json.dumps({"op": op, **args}).encode() + b"\n")
+                self._file.flush()
+                line = self._file.readline()
+            except TimeoutError:
+                # the daemon is busy, its late answer would be read as the one of the next request
+                self.close()
+                self._connect()
+                raise DaemonError(f"the icon daemon didn't answer {op!r} in time")
+        if not line:
+            raise ConnectionResetError("the icon daemon closed the connection")
+        try:
+            response = json.loads(line)
+        except ValueError as e:
+            raise DaemonError(f"invalid answer from the icon daemon: {e}")
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response["results"]
+
+    def prefix(self, theme: str, size: int, queries: list[str], limit: int | None = None) -> list[list[tuple[str, str]]]:
+        """
+        :returns: for each query, the (name, path) pairs of the system icons starting with it, sorted by name
+        """
+        return [[tuple(pair) for pair in pairs] for pairs in self.request("prefix", theme=theme, size=size, queries=queries, limit=limit)]
+
+    def fuzzy(self, theme: str, size: int, queries: list[str], limit: int = 50) -> list[list[tuple[str, str, float]]]:
+        """
+        :returns: for each query, the best limit (name, path, score) triples of the system icons, see FuzzyIndex.search
+        """
+        return [[tuple(result) for result in results] for results in self.request("fuzzy", theme=theme, size=size, queries=queries, limit=limit)]
+
+    def paths(self, theme: str, size: int, names: list[str]) -> list[str | None]:
+        """
+        :returns: the path of the best system icon of each name for size x size, None for the unknown names
+        """
+        return self.request("paths", theme=theme, size=size, names=names)
+
+    def count(self, theme: str, size: int) -> int:
+        return self.request("count", theme=theme, size=size)
+
+    def thumbnails(self, paths: list[str], size: int) -> list[str | None]:
+        """
+        :returns: the png of each path rendered by the daemon, None for the files it doesn't handle
+        """
+        return self.request("thumbnails", paths=paths, size=size)
+
+
+def merge_prefix(local: Sequence[tuple[str, str]], shared: Sequence[tuple[str, str]],
+                 rank: Callable[[str], tuple] | None = None) -> list[tuple[str, str]]:
+    """
+    Merges prefix results sorted by name
+    :param rank: sort key of a directory, when a name is on both sides the smallest key wins, see IconTheme.rank.
+     Without it, or on a tie, the icons of the user win over the system ones
+    """
+    merged: list[tuple[str, str]] = []
+    # heapq.merge is stable: on equal names the local pair comes first
+    for name, path in heapq.merge(local, shared, key=lambda pair: pair[0]):
+        if not merged or merged[-1][0] != name:
+            merged.append((name, path))
+        elif rank is not None and rank(os.path.dirname(path)) < rank(os.path.dirname(merged[-1][1])):
+            merged[-1] = (name, path)
+    return merged
+
+
+def merge_fuzzy(local: list[tuple[str, str, float]], shared: list[tuple[str, str, float]], limit: int,
+                rank: Callable[[str], tuple] | None = None) -> list[tuple[str, str, float]]:
+    """
+    Merges fuzzy results, the icon of a name on both sides is chosen as in merge_prefix
+    """
+    results = {result[0]: result for result in local}
+    for result in shared:
+        mine = results.get(result[0])
+        if mine is None or rank is not None and rank(os.path.dirname(result[1])) < rank(os.path.dirname(mine[1])):
+            results[result[0]] = result
+    merged = sorted(results.values(), key=lambda result: (-result[2], len(result[0]), result[0]))
+    return merged[:limit]
+
+
+def serve(path: str | None = None):
+    """
+    Runs the icon daemon until it is interrupted
+    """
+    with IconServer(path) as server:
+        print(f"icon daemon listening on '{server.path}'")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
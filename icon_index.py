@@ -0,0 +1,208 @@
+import os
+import json
+import pathlib
+import threading
+from typing import Callable, Iterable
+
+
+def cache_dir() -> pathlib.Path:
+    """
+    :returns: the XDG cache directory of the installer ($XDG_CACHE_HOME/app-installer)
+    """
+    return pathlib.Path(os.environ.get("XDG_CACHE_HOME") or pathlib.Path("~/.cache").expanduser()) / "app-installer"
+
+
+class IconIndex:
+    """
+    Persistent index of icon names to icon files.
+    Every scanned directory is stored along with its mtime, a warm load only stats the
+    directories and rescans the ones that changed since the last run.
+    """
+    VERSION: int = 1
+    EXTENSIONS: tuple[str, ...] = (".png", ".svg")
+
+    def __init__(self, roots: list[tuple[str, bool]], index_file: str | os.PathLike | None = None,
+                 rank: Callable[[str], tuple] | None = None):
+        """
+        :param roots: (directory, recursive) pairs
+        :param index_file: path of the persisted index, defaults to <cache_dir>/icon-index.json
+        :param rank: sort key of a directory, when a name is in several directories the smallest key wins,
+         see IconTheme.rank. Without it the last directory wins
+        """
+        self.roots = roots
+        self.rank = rank
+        self.index_file = pathlib.Path(index_file) if index_file else cache_dir() / "icon-index.json"
+        self._dirs: dict[str, tuple[int, list[str], dict[str, str]]] = {}
+        self.rescanned: int = 0
+
+    def load(self, on_icons: Callable[[dict[str, str]], None] | None = None) -> dict[str, str]:
+        """
+        Loads the persisted index and rescans the directories whose mtime changed
+        :returns: a dict mapping icon names to absolute paths
+        :param on_icons: called with the icons of each directory as soon as it is indexed
+        """
+        self._update(self._read(), on_icons=on_icons)
+        return self.to_dict()
+
+    def rebuild(self) -> dict[str, str]:
+        """
+        Discards the persisted index and rescans every root
+        :returns: a dict mapping icon names to absolute paths
+        """
+        self._update({}, force=True)
+        return self.to_dict()
+
+    def refresh(self, changed: Iterable[str] | None = None) -> tuple[dict[str, str], set[str]]:
+        """
+        Rescans the directories modified since the last load, new subdirectories are walked
+        :param changed: directories known to be modified, typically reported by inotify. Only those are
+         rescanned and the other ones aren't even stat'ed, nor is the index file rewritten: the next load
+         rescans them. When None, every directory is stat'ed
+        :returns: the icons added or whose path changed, and the names of the removed icons
+        """
+        before = self._dirs
+        if changed is None:
+            self._update(before)
+        else:
+            old = dict(before)
+            for path in changed:
+                old.pop(path, None)
+            self._update(old, trusted=True, write=False)
+        # only the names of the directories whose files changed are resolved again
+        names: set[str] = set()
+        for path in before.keys() | self._dirs.keys():
+            old_entry, new_entry = before.get(path), self._dirs.get(path)
+            if old_entry is not new_entry and (old_entry is None or new_entry is None or old_entry[2] != new_entry[2]):
+                names.update(old_entry[2] if old_entry else ())
+                names.update(new_entry[2] if new_entry else ())
+        old_icons, new_icons = self._resolve(names, before), self._resolve(names, self._dirs)
+        return {name: path for name, path in new_icons.items() if old_icons.get(name) != path}, old_icons.keys() - new_icons.keys()
+
+    def directories(self) -> list[str]:
+        """
+        :returns: the indexed directories
+        """
+        return list(self._dirs)
+
+    def to_dict(self, rank: Callable[[str], tuple] | None = None) -> dict[str, str]:
+        """
+        :returns: a dict mapping icon names to absolute paths
+        :param rank: overrides the rank of the index, to resolve the icons for another size
+        """
+        rank = rank or self.rank
+        icons: dict[str, str] = {}
+        if rank is None:
+            for path, (_, _, files) in self._dirs.items():
+                for name, file in files.items():
+                    icons[name] = os.path.join(path, file)
+            return icons
+
+        keys: dict[str, tuple] = {}
+        for path, (_, _, files) in self._dirs.items():
+            key = rank(path)
+            for name, file in files.items():
+                if name not in keys or key < keys[name]:
+                    keys[name] = key
+                    icons[name] = os.path.join(path, file)
+        return icons
+
+    def _resolve(self, names: set[str], dirs: dict[str, tuple[int, list[str], dict[str, str]]]) -> dict[str, str]:
+        """
+        Same as to_dict for a few names only
+        """
+        icons: dict[str, str] = {}
+        keys: dict[str, tuple] = {}
+        if not names:
+            return icons
+        for path, (_, _, files) in dirs.items():
+            found = [name for name in names if name in files] if len(names) < len(files) else [name for name in files if name in names]
+            if not found:
+                continue
+            key = self.rank(path) if self.rank is not None else None
+            for name in found:
+                if key is None or name not in keys or key < keys[name]:
+                    keys[name] = key
+                    icons[name] = os.path.join(path, files[name])
+        return icons
+
+    def _update(self, old: dict[str, tuple[int, list[str], dict[str, str]]], force: bool = False,
+                on_icons: Callable[[dict[str, str]], None] | None = None, trusted: bool = False, write: bool = True):
+        self.rescanned = 0
+        self._dirs = {}
+        for root, recursive in self.roots:
+            self._walk(root, recursive, old, on_icons, trusted)
+        if write and (force or self.rescanned or self._dirs.keys() != old.keys()):
+            try:
+                self._write()
+            except OSError as e:
+                print(f"ERROR: could not write the icon index '{self.index_file}': {e}")
+
+    def _walk(self, root: str, recursive: bool, old: dict[str, tuple[int, list[str], dict[str, str]]],
+              on_icons: Callable[[dict[str, str]], None] | None = None, trusted: bool = False):
+        """
+        :param trusted: reuse the entries of old without checking their mtime
+        """
+        stack: list[str] = [root]
+        seen: set[tuple[int, int]] = set()
+        while stack:
+            path = stack.pop()
+            if trusted and path in old:
+                entry = old[path]
+                self._dirs.pop(path, None)
+                self._dirs[path] = entry
+                if recursive:
+                    stack.extend(os.path.join(path, d) for d in reversed(entry[1]))
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # themes symlink directories into each other, don't loop on them
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+
+            entry = old.get(path)
+            if entry is None or entry[0] != stat.st_mtime_ns:
+                try:
+                    entry = self._scan_dir(path, stat.st_mtime_ns)
+                except OSError:
+                    continue
+                self.rescanned += 1
+            self._dirs.pop(path, None)
+            self._dirs[path] = entry
+            if on_icons is not None and entry[2]:
+                on_icons({name: os.path.join(path, file) for name, file in entry[2].items()})
+            if recursive:
+                stack.extend(os.path.join(path, d) for d in reversed(entry[1]))
+
+    def _scan_dir(self, path: str, mtime: int) -> tuple[int, list[str], dict[str, str]]:
+        subdirs: list[str] = []
+        files: dict[str, str] = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.name.endswith(self.EXTENSIONS) and entry.is_file():
+                    files[entry.name[:-4]] = entry.name
+        return mtime, sorted(subdirs), dict(sorted(files.items()))
+
+    def _read(self) -> dict[str, tuple[int, list[str], dict[str, str]]]:
+        try:
+            with open(self.index_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        return {path: tuple(entry) for path, entry in data["dirs"].items()}
+
+    def _write(self):
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        # unique per writer, the GUI and --manifest may write the index at the same time
+        tmp = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": self.VERSION, "dirs": self._dirs}, f, separators=(",", ":"))
+        os.replace(tmp, self.index_file)
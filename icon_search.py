@@ -0,0 +1,295 @@
+import array
+import bisect
+import heapq
+import itertools
+import re
+import sys
+from typing import Iterator, Mapping, MutableMapping, Sequence
+
+
+class IconView(Sequence[tuple[str, str]]):
+    """
+    Read only (name, path) pairs of a slice of an IconTable.
+    It holds the names and the ids of their directory and file suffix, the paths are only built when a pair is read,
+    about 16 bytes per icon instead of ~175 for a list of tuples. Later changes of the table don't affect it.
+    """
+    __slots__ = ("_names", "_dir_ids", "_suffix_ids", "_dirs", "_suffixes", "_other")
+
+    def __init__(self, names: list[str], dir_ids: array.array, suffix_ids: array.array,
+                 dirs: list[str], suffixes: list[str], other: dict[str, str]):
+        self._names = names
+        self._dir_ids = dir_ids
+        self._suffix_ids = suffix_ids
+        self._dirs = dirs
+        self._suffixes = suffixes
+        self._other = other
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return IconView(self._names[i], self._dir_ids[i], self._suffix_ids[i], self._dirs, self._suffixes, self._other)
+        name = self._names[i]
+        return name, self._path(name, self._dir_ids[i], self._suffix_ids[i])
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        for name, dir_id, suffix_id in zip(self._names, self._dir_ids, self._suffix_ids):
+            yield name, self._path(name, dir_id, suffix_id)
+
+    def __repr__(self) -> str:
+        return f"IconView({list(self)!r})"
+
+    def nbytes(self) -> int:
+        """
+        :returns: the memory used by the view, the strings and tables it shares with its IconTable excepted
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self._names)
+                + sys.getsizeof(self._dir_ids) + sys.getsizeof(self._suffix_ids))
+
+    def _path(self, name: str, dir_id: int, suffix_id: int) -> str:
+        if suffix_id < 0:
+            return self._other[name]
+        return self._dirs[dir_id] + name + self._suffixes[suffix_id]
+
+
+class IconTable(MutableMapping[str, str]):
+    """
+    Compact name -> path mapping of the icons, sorted by name.
+    Paths are split into an interned directory table and a file suffix table (".png", ".svg"...), each icon costs
+    its name, a list slot and two 4 byte ids. Budget: 24 bytes per icon on top of the name string
+    (~16 measured by benchmark.py at 100k icons), against ~150 for a dict of paths.
+    Being sorted it is also the prefix index: a lookup costs O(log n + k) and
+    when a query extends the previous one, only the previous range is searched.
+    """
+    def __init__(self, icons: Mapping[str, str] | None = None):
+        self._names: list[str] = []
+        self._dir_ids: array.array = array.array("I")
+        self._suffix_ids: array.array = array.array("i")
+        # append only, so that the ids held by the views stay valid
+        self._dirs: list[str] = []
+        self._suffixes: list[str] = []
+        self._dir_index: dict[str, int] = {}
+        self._suffix_index: dict[str, int] = {}
+        # paths whose file name doesn't start with the icon name, their suffix id is -1
+        self._other: dict[str, str] = {}
+        self._last: tuple[str, int, int] = ("", 0, 0)
+        if icons:
+            self._names = sorted(icons)
+            for name in self._names:
+                dir_id, suffix_id = self._intern(name, icons[name])
+                self._dir_ids.append(dir_id)
+                self._suffix_ids.append(suffix_id)
+            self._last = ("", 0, len(self._names))
+
+    def _intern(self, name: str, path: str) -> tuple[int, int]:
+        directory, separator, file = path.rpartition("/")
+        directory += separator
+        dir_id = self._dir_index.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_index[directory] = len(self._dirs)
+            self._dirs.append(directory)
+        if not file.startswith(name):
+            self._other[name] = path
+            return dir_id, -1
+        self._other.pop(name, None)
+        suffix = file[len(name):]
+        suffix_id = self._suffix_index.get(suffix)
+        if suffix_id is None:
+            suffix_id = self._suffix_index[suffix] = len(self._suffixes)
+            self._suffixes.append(suffix)
+        return dir_id, suffix_id
+
+    def _find(self, name: str) -> int:
+        i = bisect.bisect_left(self._names, name)
+        if i == len(self._names) or self._names[i] != name:
+            raise KeyError(name)
+        return i
+
+    def _view(self, lo: int, hi: int) -> IconView:
+        return IconView(self._names[lo:hi], self._dir_ids[lo:hi], self._suffix_ids[lo:hi], self._dirs, self._suffixes,
+                        {name: self._other[name] for name in self._names[lo:hi] if name in self._other} if self._other else {})
+
+    def __getitem__(self, name: str) -> str:
+        i = self._find(name)
+        if self._suffix_ids[i] < 0:
+            return self._other[name]
+        return self._dirs[self._dir_ids[i]] + name + self._suffixes[self._suffix_ids[i]]
+
+    def __setitem__(self, name: str, path: str):
+        dir_id, suffix_id = self._intern(name, path)
+        i = bisect.bisect_left(self._names, name)
+        if i < len(self._names) and self._names[i] == name:
+            self._dir_ids[i], self._suffix_ids[i] = dir_id, suffix_id
+            return
+        self._names.insert(i, name)
+        self._dir_ids.insert(i, dir_id)
+        self._suffix_ids.insert(i, suffix_id)
+        self._last = ("", 0, len(self._names))
+
+    def __delitem__(self, name: str):
+        i = self._find(name)
+        del self._names[i], self._dir_ids[i], self._suffix_ids[i]
+        self._other.pop(name, None)
+        self._last = ("", 0, len(self._names))
+
+    def __contains__(self, name: object) -> bool:
+        i = bisect.bisect_left(self._names, name)
+        return i < len(self._names) and self._names[i] == name
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def items(self) -> IconView:
+        return self._view(0, len(self._names))
+
+    def range(self, prefix: str) -> tuple[int, int]:
+        """
+        :returns: the [start, stop) indices of the sorted names starting with prefix
+        """
+        last_prefix, lo, hi = self._last
+        if not prefix.startswith(last_prefix):
+            lo, hi = 0, len(self._names)
+        if prefix:
+            lo = bisect.bisect_left(self._names, prefix, lo, hi)
+            if ord(prefix[-1]) < 0x10FFFF:
+                hi = bisect.bisect_left(self._names, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo, hi)
+        self._last = (prefix, lo, hi)
+        return lo, hi
+
+    def search(self, prefix: str) -> IconView:
+        """
+        :returns: the (name, path) pairs of the icons starting with prefix, sorted by name
+        """
+        return self._view(*self.range(prefix))
+
+    def nbytes(self) -> int:
+        """
+        :returns: the memory used by the table, the name strings excepted since the indexes share them
+        """
+        return (sys.getsizeof(self._names) + self._dir_ids.buffer_info()[1] * self._dir_ids.itemsize
+                + self._suffix_ids.buffer_info()[1] * self._suffix_ids.itemsize
+                + sum(sys.getsizeof(d) for d in self._dirs) + sum(sys.getsizeof(s) for s in self._suffixes)
+                + sys.getsizeof(self._dirs) + sys.getsizeof(self._dir_index) + sys.getsizeof(self._other)
+                + sum(sys.getsizeof(path) for path in self._other.values()))
+
+
+class FuzzyIndex:
+    """
+    Ranked substring/subsequence search over the icon names.
+    The lowercased names are joined in a single newline separated string sorted by (length, name),
+    so each tier is a regex scan done in C that can stop after `limit` matches: the first matches are the shortest names.
+    Tiers: exact match, prefix, substring after a separator, substring anywhere, subsequence.
+    Over 50k names a query takes 1-3 ms, but one matching nothing scans every name in every tier: 8-15 ms,
+    unless one of its characters is in no name.
+    Names added or removed afterwards go to a small overlay and tombstones until there are
+    more than max_pending of them, then the index is rebuilt.
+    """
+    SEPARATORS: str = "-_. "
+    max_pending: int = 1024
+
+    def __init__(self, icons: Mapping[str, str]):
+        self._icons = icons
+        self._build()
+
+    def _build(self):
+        self._names: list[str] = sorted(self._icons, key=lambda name: (len(name), name))
+        self._blob: str = "\n" + "\n".join(self._names).lower() + "\n"
+        self._starts: array.array = array.array("I", itertools.accumulate((len(name) + 1 for name in self._names), initial=1))
+        # a query with a character found in no name can't match, it is answered without scanning
+        self._chars: frozenset[str] = frozenset(self._blob)
+        self._removed: set[int] = set()
+        self._overlay: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._names) - len(self._removed) + len(self._overlay)
+
+    def nbytes(self) -> int:
+        """
+        :returns: the memory used by the index, the name strings excepted since the indexes share them
+        """
+        return (sys.getsizeof(self._names) + sys.getsizeof(self._blob) + sys.getsizeof(self._starts)
+                + sys.getsizeof(self._chars) + sys.getsizeof(self._removed) + sys.getsizeof(self._overlay))
+
+    def add(self, name: str):
+        """
+        Indexes a name that was added to the icon dict
+        """
+        if self._position(name) is None:
+            self._overlay.add(name)
+            self._compact()
+
+    def remove(self, name: str):
+        """
+        Unindexes a name that was removed from the icon dict
+        """
+        i = self._position(name)
+        if i is not None:
+            self._removed.add(i)
+            self._compact()
+        self._overlay.discard(name)
+
+    def _position(self, name: str) -> int | None:
+        i = bisect.bisect_left(self._names, (len(name), name), key=lambda name: (len(name), name))
+        if i < len(self._names) and self._names[i] == name and i not in self._removed:
+            return i
+        return None
+
+    def _compact(self):
+        if len(self._overlay) + len(self._removed) > self.max_pending:
+            self._build()
+
+    def search(self, query: str, limit: int = 50) -> list[tuple[str, str, float]]:
+        """
+        :returns: at most limit (name, path, score) triples sorted by decreasing score.
+         The score is in (0, 1], 1 being an exact match
+        :param query: case insensitive
+        """
+        query = query.lower()
+        if not query or limit <= 0 or "\n" in query:
+            return []
+        q = re.escape(query)
+        # [^\nc]*+c can only match one way and doesn't backtrack on a failure, unlike .*?c
+        subsequence = re.escape(query[0]) + "".join("[^\n{0}]*+{0}".format(re.escape(c)) for c in query[1:])
+        tiers: list[tuple[Iterator[tuple[int, int]], float | None]] = [
+            (self._find(f"\n{q}\n"), 1.0),
+            (self._find(f"\n{q}"), 0.9),
+            # one literal scan per separator is much faster than a [-_. ] character class
+            (heapq.merge(*(self._find(re.escape(sep) + q) for sep in self.SEPARATORS)), 0.8),
+            (self._find(q), 0.7),
+            (self._find(subsequence), None),
+        ]
+        results: list[tuple[str, str, float]] = []
+        seen: set[int] = set(self._removed)
+        for matches, score in tiers if self._chars.issuperset(query) else ():
+            tier: list[tuple[str, str, float]] = []
+            for i, span in matches:
+                if i in seen:
+                    continue
+                seen.add(i)
+                name = self._names[i]
+                # subsequences score by how tight the matched span is
+                tier.append((name, self._icons[name], score if score is not None else 0.5 * len(query) / span))
+                if len(results) + len(tier) >= limit:
+                    break
+            tier.sort(key=lambda result: -result[2])
+            results.extend(tier)
+            if len(results) >= limit:
+                break
+        if self._overlay:
+            results += FuzzyIndex({name: self._icons[name] for name in self._overlay}).search(query, limit)
+            results.sort(key=lambda result: (-result[2], len(result[0]), result[0]))
+            del results[limit:]
+        return results
+
+    def _find(self, pattern: str) -> Iterator[tuple[int, int]]:
+        """
+        :returns: the (name index, match length) of each match, in (length, name) order
+        """
+        for match in re.finditer(pattern, self._blob):
+            # the span of the group when the pattern has one
+            start, end = match.span(match.lastindex or 0)
+            yield bisect.bisect_right(self._starts, end - 1) - 1, end - start
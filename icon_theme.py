@@ -0,0 +1,166 @@
+import os
+import configparser
+from typing import Callable, NamedTuple
+
+
+def base_dirs() -> list[str]:
+    """
+    :returns: the directories icon themes are looked up in, see the freedesktop icon theme specification
+    """
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    data_dirs = (os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share").split(":")
+    return [os.path.expanduser("~/.icons"), os.path.join(data_home, "icons"), *(os.path.join(d, "icons") for d in data_dirs if d)]
+
+
+def user_dirs() -> list[str]:
+    """
+    :returns: the base directories of base_dirs() that belong to the user
+    """
+    return base_dirs()[:2]
+
+
+def system_dirs() -> list[str]:
+    """
+    :returns: the base directories of base_dirs() shared by every user
+    """
+    return base_dirs()[2:]
+
+
+def system_themes() -> list[str]:
+    """
+    :returns: the names of the themes installed in system_dirs()
+    """
+    return sorted({entry.name for d in system_dirs() if os.path.isdir(d) for entry in os.scandir(d)
+                   if os.path.isfile(os.path.join(entry.path, "index.theme"))})
+
+
+class ThemeDirectory(NamedTuple):
+    """
+    A subdirectory of an index.theme
+    """
+    size: int
+    scale: int = 1
+    type: str = "Threshold"
+    min_size: int = 0
+    max_size: int = 0
+    threshold: int = 2
+
+    def distance(self, size: int) -> int:
+        """
+        :returns: 0 if the directory matches size, how far it is from it otherwise
+        """
+        if self.type == "Fixed":
+            return abs(self.size - size)
+        if self.type == "Scalable":
+            low, high = self.min_size, self.max_size
+        else:
+            low, high = self.size - self.threshold, self.size + self.threshold
+        return low - size if size < low else size - high if size > high else 0
+
+
+class IconTheme:
+    """
+    freedesktop icon theme resolution: the index.theme of the theme, of the themes it inherits from and of hicolor
+    are parsed once, then rank() tells which directory holds the best icon for a size.
+    Only the application icons are considered.
+    """
+    def __init__(self, name: str, dirs: list[str] | None = None, pixmaps: str = "/usr/share/pixmaps"):
+        """
+        :param dirs: base directories of the themes, defaults to base_dirs()
+        :param pixmaps: directory of the unthemed icons, searched last. Empty to leave them out
+        """
+        self.name = name
+        self.base_dirs = dirs if dirs is not None else base_dirs()
+        self.pixmaps = pixmaps
+        self.themes: list[str] = []
+        self.directories: dict[str, tuple[int, ThemeDirectory]] = {}
+        self._unindexed: list[str] = []
+        self._ranks: dict[int, Callable[[str], tuple]] = {}
+
+        pending, visited = [name], set()
+        while pending:
+            theme = pending.pop(0)
+            if theme and theme not in visited:
+                visited.add(theme)
+                pending += self._load(theme)
+            if not pending and "hicolor" not in visited:
+                pending.append("hicolor")
+
+    def _load(self, theme: str) -> list[str]:
+        """
+        :returns: the themes it inherits from
+        """
+        index = next((os.path.join(d, theme, "index.theme") for d in self.base_dirs if os.path.isfile(os.path.join(d, theme, "index.theme"))), None)
+        if index is None:
+            # not a real theme, keep the old behaviour of scanning its apps folder
+            self._unindexed += [path for d in self.base_dirs if os.path.isdir(path := os.path.join(d, theme, "apps"))]
+            return []
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
+        parser.optionxform = str
+        try:
+            parser.read(index, encoding="utf-8")
+        except (configparser.Error, UnicodeDecodeError) as e:
+            print(f"ERROR: could not parse '{index}': {e}")
+            return []
+        if not parser.has_section("Icon Theme"):
+            return []
+        self.themes.append(theme)
+        rank = len(self.themes) - 1
+
+        header = parser["Icon Theme"]
+        subdirs = header.get("Directories", "").split(",") + header.get("ScaledDirectories", "").split(",")
+        for subdir in filter(None, (s.strip() for s in subdirs)):
+            if not parser.has_section(subdir):
+                continue
+            section = parser[subdir]
+            if section.get("Context", "Applications" if "apps" in subdir.lower() else "") != "Applications":
+                continue
+            try:
+                size = int(section["Size"])
+                directory = ThemeDirectory(size,
+                                           int(section.get("Scale", 1)),
+                                           section.get("Type", "Threshold"),
+                                           int(section.get("MinSize", size)),
+                                           int(section.get("MaxSize", size)),
+                                           int(section.get("Threshold", 2)))
+            except (KeyError, ValueError):
+                continue
+            for d in self.base_dirs:
+                path = os.path.join(d, theme, subdir)
+                if path not in self.directories and os.path.isdir(path):
+                    self.directories[path] = (rank, directory)
+        return [parent.strip() for parent in header.get("Inherits", "").split(",") if parent.strip()]
+
+    def roots(self, under: list[str] | None = None) -> list[tuple[str, bool]]:
+        """
+        :returns: the (directory, recursive) pairs to index: the theme directories, then the unthemed icons of ~/.icons and pixmaps
+        :param under: only keeps the directories inside these base directories
+        """
+        roots = ([(path, False) for path in self.directories] + [(path, True) for path in self._unindexed]
+                 + [(self.base_dirs[0], False)])
+        if self.pixmaps:
+            roots.append((self.pixmaps, True))
+        if under is not None:
+            prefixes = tuple(os.path.join(d, "") for d in under)
+            roots = [(path, recursive) for path, recursive in roots if path in under or path.startswith(prefixes)]
+        return roots
+
+    def rank(self, size: int) -> Callable[[str], tuple]:
+        """
+        :returns: a function giving a sort key to an indexed directory, the smaller the better for icons of size x size:
+         earlier theme of the inheritance chain, closest size, bigger rather than smaller, scale 1, bitmap rather than svg.
+         Precomputed once per size
+        """
+        if size not in self._ranks:
+            keys = {path: (rank, directory.distance(size), directory.size * directory.scale < size, directory.scale != 1, directory.type == "Scalable")
+                    for path, (rank, directory) in self.directories.items()}
+            unthemed = len(self.themes)
+            user_icons = self.base_dirs[0]
+
+            def rank(path: str) -> tuple:
+                key = keys.get(path)
+                if key is None:
+                    return unthemed + (path != user_icons), 0, False, False, False
+                return key
+            self._ranks[size] = rank
+        return self._ranks[size]
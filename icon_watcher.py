@@ -0,0 +1,129 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from typing import Callable, Iterable
+
+IN_MODIFY_ENTRIES: int = 0x100 | 0x200 | 0x40 | 0x80  # IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+IN_ONLYDIR: int = 0x01000000
+IN_IGNORED: int = 0x8000
+IN_Q_OVERFLOW: int = 0x4000
+_EVENT = struct.Struct("iIII")
+
+
+class IconWatcher:
+    """
+    Watches icon directories and calls on_change(changed) from a background thread when files are added,
+    removed or renamed in them. changed is the set of modified directories, or None when they are unknown
+    and everything should be checked.
+    Uses inotify when available, otherwise calls on_change(None) every poll_interval seconds.
+    """
+    def __init__(self, on_change: Callable[[set[str] | None], None], poll_interval: float = 5.0, settle: float = 0.2):
+        """
+        :param settle: events are gathered for that many seconds before on_change is called, so that
+         copying a whole theme doesn't trigger one refresh per file
+        """
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self._fd: int = -1
+        self._libc: ctypes.CDLL | None = None
+        self._watches: dict[int, str] = {}
+        self._watched: set[str] = set()
+        # set by watch() when inotify runs out of watches, the thread then switches to polling
+        self._out_of_watches: bool = False
+        self._lock = threading.Lock()
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="icon-watcher")
+
+    @property
+    def polling(self) -> bool:
+        return self._fd < 0
+
+    def start(self, directories: Iterable[str]):
+        """
+        Starts watching, or watches more directories when already started
+        """
+        if self._thread.is_alive():
+            self.watch(directories)
+            return
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            self._fd = -1
+        self.watch(directories)
+        self._thread.start()
+
+    def watch(self, directories: Iterable[str]):
+        """
+        Watches the directories that are not watched yet
+        """
+        if self.polling or self._out_of_watches:
+            return
+        with self._lock:
+            for path in directories:
+                if path in self._watched:
+                    continue
+                wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), IN_MODIFY_ENTRIES | IN_ONLYDIR)
+                if wd >= 0:
+                    self._watches[wd] = path
+                    self._watched.add(path)
+                elif ctypes.get_errno() == errno.ENOSPC:
+                    # out of inotify watches, every directory can't be watched anymore
+                    print("ERROR: inotify watch limit reached, polling the icon directories instead")
+                    self._out_of_watches = True
+                    # the thread may be blocked in select on the inotify fd, only it closes it
+                    os.write(self._stop_w, b"p")
+                    return
+
+    def stop(self):
+        os.write(self._stop_w, b"\0")
+
+    def _run(self):
+        while True:
+            if self.polling:
+                if select.select([self._stop_r], [], [], self.poll_interval)[0]:
+                    return
+                self.on_change(None)
+                continue
+
+            fd = self._fd
+            changed: set[str] | None = set()
+            if self._stop_r in select.select([fd, self._stop_r], [], [])[0]:
+                if b"\0" in os.read(self._stop_r, 64):
+                    return
+                # woken up by watch(): switch to polling, directories may have changed unnoticed
+                os.close(fd)
+                self._fd = -1
+                self.on_change(None)
+                continue
+            # keep reading until no event arrived for settle seconds
+            while select.select([fd], [], [], self.settle)[0]:
+                changed = self._read_events(fd, changed)
+            if changed is None or changed:
+                self.on_change(changed)
+
+    def _read_events(self, fd: int, changed: set[str] | None) -> set[str] | None:
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        except OSError:
+            return None
+        offset = 0
+        with self._lock:
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed = None
+                elif mask & IN_IGNORED:
+                    # the directory was removed, its parent reports it
+                    self._watched.discard(self._watches.pop(wd, ""))
+                elif changed is not None and wd in self._watches:
+                    changed.add(self._watches[wd])
+        return changed
@@ -0,0 +1,112 @@
+import os
+import re
+import errno
+import shutil
+import hashlib
+import pathlib
+import threading
+import subprocess
+
+# characters that force an Exec argument to be quoted, see the desktop entry specification
+_EXEC_RESERVED = re.compile(r"""[\s"'\\><~|&;$*?#()`]""")
+_STRING_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\t": "\\t", "\r": "\\r"})
+
+
+def exec_arg(arg: str) -> str:
+    """
+    :returns: arg quoted for the Exec key of a .desktop file
+    """
+    arg = arg.replace("%", "%%")
+    if not arg or _EXEC_RESERVED.search(arg):
+        arg = '"' + re.sub(r'(["`$\\])', r"\\\1", arg) + '"'
+    return arg
+
+
+def exec_command(*args: str) -> str:
+    """
+    :returns: the value of an Exec key running args
+    """
+    return " ".join(exec_arg(arg) for arg in args)
+
+
+def desktop_entry(name: str, executable: str, icon: str, category: str) -> str:
+    """
+    :returns: the content of the .desktop file, always the same for the same arguments
+    :param executable: value of the Exec key, see exec_command
+    """
+    keys: list[tuple[str, str]] = [("Type", "Application"), ("Name", name), ("Exec", executable)]
+    if icon:
+        keys.append(("Icon", icon))
+    if category:
+        keys.append(("Categories", category))
+    keys.append(("Terminal", "false"))
+    return "[Desktop Entry]\n" + "".join(f"{key}={value.translate(_STRING_ESCAPES)}\n" for key, value in keys)
+
+
+class LauncherWriter:
+    """
+    Writes launchers in ~/.local/share/applications.
+    Writes are atomic and skipped when the launcher is unchanged, the desktop database is
+    refreshed once by refresh() after a batch of writes.
+    """
+    def __init__(self, directory: str | os.PathLike | None = None):
+        self.directory = pathlib.Path(directory or os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"), "applications"))
+        self._dirty: bool = False
+        self._lock = threading.Lock()
+
+    def path_for(self, name: str) -> pathlib.Path:
+        """
+        :returns: the launcher of the app name. Names that aren't a valid file name as is get a hash of the
+         full name, so that "My App" and "My-App" don't share a launcher
+        """
+        stem = re.sub(r"[^\w.-]+", "-", name).strip("-.")
+        if stem != name:
+            stem = f"{stem or 'app'}-{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+        return self.directory / (stem + ".desktop")
+
+    def write(self, name: str, executable: str, icon: str, category: str) -> bool:
+        """
+        :returns: False if the launcher was already up to date
+        Raises a FileExistsError if the launcher file belongs to another app
+        """
+        path = self.path_for(name)
+        content = desktop_entry(name, executable, icon, category).encode()
+        try:
+            existing = path.read_bytes()
+        except FileNotFoundError:
+            pass
+        else:
+            if existing == content:
+                return False
+            if f"\nName={name.translate(_STRING_ESCAPES)}\n".encode() not in existing:
+                raise FileExistsError(errno.EEXIST, "the launcher file belongs to another app", str(path))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+        with self._lock:
+            self._dirty = True
+        return True
+
+    def refresh(self) -> None:
+        """
+        Runs update-desktop-database if a launcher was written since the last refresh
+        May raise a subprocess.CalledProcessError
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, False
+        if dirty and shutil.which("update-desktop-database"):
+            subprocess.run(["update-desktop-database", str(self.directory)], capture_output=True, text=True, check=True)
+
+
+def install_launcher(name: str, executable: str, icon: str, category: str) -> None:
+    """
+    Installs the launcher of an app
+    May raise a subprocess.CalledProcessError or an OSError
+    :param executable: value of the Exec key, see exec_command
+    :param icon: icon name or absolute path of the icon
+    :param category: categories separated by semicolons
+    """
+    writer = LauncherWriter()
+    writer.write(name, executable, icon, category)
+    writer.refresh()
@@ -0,0 +1,131 @@
+import os
+import tomllib
+import subprocess
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from model import FormError, CATEGORIES, executable_command, icon_index
+from launcher import LauncherWriter
+from icon_index import IconIndex
+
+
+@dataclass
+class ManifestEntry:
+    """
+    One app of a manifest, validated and ready to be installed
+    """
+    name: str
+    executable: str
+    icon: str
+    category: str
+
+
+def parse_manifest(data: dict, icons: IconIndex | None = None) -> tuple[list[ManifestEntry], list[str]]:
+    """
+    Validates every [[app]] table of a manifest.
+    Icons are either paths to png/svg files or names from the icon index, which is loaded once, on the first name
+    :returns: the valid entries and the error message of each invalid one
+    :param icons: index the icon names are resolved against, defaults to the one of Model
+    """
+    entries: list[ManifestEntry] = []
+    errors: list[str] = []
+    icon_dict: dict[str, str] | None = None
+    # launcher file -> index of the app it belongs to, the apps are written concurrently
+    launchers: dict[str, int] = {}
+    apps = data.get("app", [])
+    if not isinstance(apps, list) or not apps:
+        return [], ["the manifest has no [[app]] table"]
+
+    for i, app in enumerate(apps):
+        name = app.get("name", "") if isinstance(app, dict) else ""
+        try:
+            if not isinstance(name, str) or not name:
+                raise FormError("the name is invalid")
+            launcher = LauncherWriter().path_for(name).name
+            if launcher in launchers:
+                raise FormError(f"app #{launchers[launcher] + 1} has the same launcher '{launcher}'")
+            launchers[launcher] = i
+            executable, icon = app.get("executable", ""), app.get("icon", "")
+            if not isinstance(executable, str) or not isinstance(icon, str):
+                raise FormError("the executable and the icon must be strings")
+            executable = os.path.expanduser(executable)
+            command = executable_command(executable) if os.path.isfile(executable) else ""
+            if not command:
+                raise FormError(f"the executable file '{executable}' is invalid")
+
+            if icon.endswith((".png", ".svg")) or os.sep in icon:
+                icon = os.path.abspath(os.path.expanduser(icon))
+                if not os.path.isfile(icon):
+                    raise FormError(f"the icon file '{icon}' does not exist")
+            elif icon:
+                if icon_dict is None:
+                    icon_dict = (icons or icon_index()).load()
+                if icon not in icon_dict:
+                    raise FormError(f"the icon '{icon}' is not in the icon index")
+
+            categories = app.get("category", [])
+            categories = [categories] if isinstance(categories, str) else categories
+            if not isinstance(categories, list):
+                raise FormError("the category must be a string or a list of strings")
+            for category in categories:
+                if category not in CATEGORIES:
+                    raise FormError(f"the category '{category}' is invalid")
+        except FormError as e:
+            errors.append(f"app #{i + 1} {name!r}: {e}")
+        else:
+            entries.append(ManifestEntry(name, command, icon, "".join(category + ";" for category in dict.fromkeys(categories))))
+    return entries, errors
+
+
+def install_manifest(entries: list[ManifestEntry], jobs: int = 4, writer: LauncherWriter | None = None) -> list[tuple[ManifestEntry, str]]:
+    """
+    Installs the entries with at most jobs installations running at once.
+    The desktop database is refreshed once, after every launcher is written
+    :returns: each entry with its error message, empty when it was installed
+    """
+    writer = writer or LauncherWriter()
+    def install(entry: ManifestEntry) -> str:
+        try:
+            writer.write(entry.name, entry.executable, entry.icon, entry.category)
+        except OSError as e:
+            return str(e)
+        return ""
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(zip(entries, executor.map(install, entries)))
+    try:
+        writer.refresh()
+    except subprocess.CalledProcessError as e:
+        error = f"update-desktop-database error ({e.returncode}): {(e.stderr or '').strip()}"
+        results = [(entry, entry_error or error) for entry, entry_error in results]
+    return results
+
+
+def run_manifest(path: str, jobs: int = 4) -> int:
+    """
+    Headless install of every app of a toml manifest, nothing is installed if an entry is invalid.
+    Prints a report with one line per entry
+    :returns: the exit code, 0 when every app was installed
+    """
+    try:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        print(f"ERROR: could not read the manifest '{path}': {e}")
+        return 2
+
+    entries, errors = parse_manifest(data)
+    if errors:
+        for error in errors:
+            print(f"[invalid] {error}")
+        print(f"{len(errors)} invalid apps, nothing was installed")
+        return 2
+
+    failed = 0
+    for entry, error in install_manifest(entries, jobs):
+        if error:
+            failed += 1
+            print(f"[failed]  {entry.name}: {error}")
+        else:
+            print(f"[ok]      {entry.name}")
+    print(f"{len(entries) - failed}/{len(entries)} apps installed")
+    return 1 if failed else 0
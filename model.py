@@ -1,13 +1,23 @@
 import os
-import glob
 import subprocess
-import getpass
-import cairosvg
 import pathlib
-from typing import Self
+from typing import Callable, MutableMapping, Self, Sequence, TypeVar
 import abc
+import functools
 import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from icon_index import IconIndex, cache_dir
+from icon_theme import IconTheme, user_dirs
+from icon_watcher import IconWatcher
+from icon_search import IconTable, IconView, FuzzyIndex
+from cache import LRUCache
+from thumbnails import ThumbnailCache
+from icon_daemon import IconClient, DaemonError, merge_prefix, merge_fuzzy
+from launcher import exec_command, install_launcher
+from profiling import profiler, traced
 class FormError(Exception): pass
+T = TypeVar("T")
 
 
 class IDialogManager(abc.ABC):
@@ -21,6 +31,14 @@ class IDialogManager(abc.ABC):
          ex: (("Images", "*.png", "*.jpg", "*.jpeg"), ("All files", "*"))
         :param root_dir: Absolute path to the directory where the dialog will open
         """
+    def get_file_async(self, filters: tuple[tuple[str, ...]] = (), root_dir: str = "~") -> Future[str]:
+        """
+        Same as get_file without blocking the caller
+        :returns: a future of the absolute path of the file, empty if the dialog was cancelled
+        """
+        future: Future[str] = Future()
+        future.set_result(self.get_file(filters, root_dir))
+        return future
     @abc.abstractmethod
     def showinfo(self, title: str, message: str) -> None:
         """
@@ -43,14 +61,19 @@ class IDialogManager(abc.ABC):
 
 
 class CinnamonDialogManager(IDialogManager):
+    """
+    zenity dialogs. Each dialog is its own zenity process, waited for in a worker thread
+    so the messages and get_file_async never block the caller
+    """
     __instance: Self | None = None
     def __new__(cls):
         if cls.__instance is None:
             cls.__instance = super().__new__(cls)
+            cls.__instance._executor = ThreadPoolExecutor(thread_name_prefix="zenity")
         return cls.__instance
     
     def get_file(self, filters: tuple[tuple[str, ...]] = (), root_dir: str = "~") -> str:
-        args: list[str] = ["zenity", "--file-selection"]
+        args: list[str] = ["zenity", "--file-selection", f"--filename={os.path.join(os.path.expanduser(root_dir), '')}"]
         for pattern in filters:
             args.append(f"--file-filter={pattern[0] + ' | ' + ' '.join(pattern[1::])}")
         return subprocess.run(
@@ -58,50 +81,226 @@ class CinnamonDialogManager(IDialogManager):
             capture_output=True, 
             text=True
             ).stdout[:-1]
+
+    def get_file_async(self, filters: tuple[tuple[str, ...]] = (), root_dir: str = "~") -> Future[str]:
+        return self._executor.submit(self.get_file, filters, root_dir)
     
     def showinfo(self, title: str = "information", message: str = "showinfo") -> None:
-        subprocess.run(["zenity", "--info", f"--text={message}"])
+        self._executor.submit(subprocess.run, ["zenity", "--info", f"--title={title}", f"--text={message}"])
+
+    def showwarning(self, title: str = "warning", message: str = "warning") -> None:
+        self._executor.submit(subprocess.run, ["zenity", "--warning", f"--title={title}", f"--text={message}"])
+
+    def showerror(self, title: str = "error", message: str = "error message") -> None:
+        self._executor.submit(subprocess.run, ["zenity", "--error", f"--title={title}", f"--text={message}"])
+
+
+class TkDialogManager(IDialogManager):
+    """
+    In-process tkinter dialogs, nothing is forked. They run a nested event loop so the windows keep redrawing.
+    Needs a Tk root window
+    """
+    __instance: Self | None = None
+    def __new__(cls):
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+        return cls.__instance
+
+    def get_file(self, filters: tuple[tuple[str, ...]] = (), root_dir: str = "~") -> str:
+        from tkinter import filedialog
+        return filedialog.askopenfilename(
+            filetypes=[(pattern[0], " ".join(pattern[1::])) for pattern in filters],
+            initialdir=os.path.expanduser(root_dir)
+            ) or ""
+
+    def showinfo(self, title: str = "information", message: str = "showinfo") -> None:
+        from tkinter import messagebox
+        messagebox.showinfo(title, message)
 
     def showwarning(self, title: str = "warning", message: str = "warning") -> None:
-        subprocess.run(["zenity", "--warning", f"--text={message}"])
+        from tkinter import messagebox
+        messagebox.showwarning(title, message)
 
     def showerror(self, title: str = "error", message: str = "error message") -> None:
-        subprocess.run(["zenity", "--error", f"--text={message}"])
+        from tkinter import messagebox
+        messagebox.showerror(title, message)
+
+
+@functools.cache
+def get_dialog_manager() -> IDialogManager:
+    """
+    Picks the dialog backend: $APP_INSTALLER_DIALOGS ("zenity" or "tk") when set,
+    otherwise zenity on the GTK desktops it fits in and tkinter everywhere else.
+    The choice is made on the first call
+    """
+    backend = os.environ.get("APP_INSTALLER_DIALOGS", "").lower()
+    if not backend:
+        desktop = os.environ.get("XDG_CURRENT_DESKTOP", "").upper()
+        backend = "zenity" if any(gtk in desktop for gtk in ("CINNAMON", "GNOME", "MATE", "XFCE")) else "tk"
+    if backend == "zenity" and shutil.which("zenity"):
+        return CinnamonDialogManager()
+    return TkDialogManager()
+
+
+
+CATEGORIES: list[str] = ["Accesories", "Education", "Games", "Graphics", "Internet", "Office", "Other", "Programming", "SoundVideo", "Administration", "Preferences"]
 
 
+def executable_command(file: str) -> str:
+    """
+    :returns: the command that launches file, quoted for a .desktop file. Empty if file can't be launched
+    """
+    if os.access(file, os.X_OK):
+        return exec_command(file)
+    elif file.endswith("jar"):
+        return exec_command("java", "-jar", file)
+    elif file.endswith("py"):
+        return exec_command("python", file)
+    return ""
+
+
+def icon_theme_name() -> str:
+    """
+    :returns: the icon theme of the desktop
+    """
+    return subprocess.run("gsettings get org.cinnamon.desktop.interface icon-theme", shell=True, capture_output=True, text=True).stdout[1:-2]
+
+
+def icon_index(size: int = 32) -> IconIndex:
+    """
+    :returns: the icon index of the desktop icon theme, resolving each name to its best icon for size x size
+    """
+    theme = IconTheme(icon_theme_name())
+    return IconIndex(theme.roots(), rank=theme.rank(size))
+
 
 class Model:
+    icon_size: int = 32
     def __init__(self):
         self._name: str = ""
         self._executable: str = ""
         self._icon: str = ""
         self._cateogry: str = ""
-        icon_theme: str = subprocess.run("gsettings get org.cinnamon.desktop.interface icon-theme", shell=True, capture_output=True, text=True).stdout[1:-2]
-        self._icon_dict: dict[str, str] = {}
-        self._icon_cache: dict[str, list[tuple[str, str]]] = {"":[]}
+        self._icon_theme: IconTheme | None = None
+        self._icon_index: IconIndex | None = None
+        # a plain dict while the icons are being discovered, then an IconTable
+        self._icon_dict: MutableMapping[str, str] = {}
+        self._size_tables: dict[int, IconTable] = {}
+        self._fuzzy_index = FuzzyIndex({})
+        self._icon_cache: LRUCache[str, IconView] = LRUCache(maxsize=64)
+        self._fuzzy_cache: LRUCache[tuple[str, int], list[tuple[str, str, float]]] = LRUCache(maxsize=64)
+        self._icon_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._icon_watcher = IconWatcher(self._on_icon_dirs_changed)
+        self._thumbnails = ThumbnailCache()
+        # the icon daemon, when it runs, serves the system-wide icons, see icon_daemon.py
+        self._daemon: IconClient | None = None
+        # directories modified by add_icon while indexing, None once the icons are loaded
+        self._pending_dirs: set[str] | None = set()
+        self._indexing = threading.Thread(target=self._load_icons, daemon=True)
+        self._indexing.start()
 
-        for path in glob.iglob("**/*.[ps][nv]g", recursive=True, root_dir=f"/usr/share/icons/{icon_theme}/apps"):
-            if os.path.isfile(f"/usr/share/icons/{icon_theme}/apps/" + path):
-                self._icon_dict[os.path.split(path)[1][:-4]] = f"/usr/share/icons/{icon_theme}/apps/" + path
+    def _load_icons(self, use_daemon: bool = True):
+        theme_name = icon_theme_name()
+        daemon = IconClient.connect() if use_daemon else None
+        if daemon is not None:
+            # only the icons of the user are scanned, the whole theme ranks them and the icons of the daemon alike
+            self._icon_theme = IconTheme(theme_name)
+            self._icon_index = IconIndex(self._icon_theme.roots(user_dirs()), cache_dir() / "icon-index-user.json", self._icon_theme.rank(self.icon_size))
+        else:
+            self._icon_theme = IconTheme(theme_name)
+            self._icon_index = IconIndex(self._icon_theme.roots(), rank=self._icon_theme.rank(self.icon_size))
+        self._daemon = daemon
+        with self._icon_lock:
+            # a dict again when reindexing after the daemon went away, see _add_indexed_icons
+            self._icon_dict = dict(self._icon_dict.items())
+            if self._pending_dirs is None:
+                self._pending_dirs = set()
+        with self._index_lock:
+            with profiler.span("index.build"):
+                self._set_icons(self._icon_index.load(on_icons=self._add_indexed_icons))
+            self._icon_watcher.start(self._icon_index.directories())
+        with self._icon_lock:
+            pending, self._pending_dirs = self._pending_dirs, None
+        if pending:
+            self._on_icon_dirs_changed(pending)
 
-        for path in glob.iglob("*.[ps][nv]g", root_dir=f"/home/{getpass.getuser()}/.icons"):
-            if os.path.isfile(f"/home/{getpass.getuser()}/.icons/{path}"):
-                self._icon_dict[os.path.split(path)[1][:-4]] = f"/home/{getpass.getuser()}/.icons/{path}"
+    def _on_icon_dirs_changed(self, changed: set[str] | None):
+        """
+        Applies the icons added, removed or renamed in the changed directories, see IconWatcher
+        """
+        with self._index_lock, profiler.span("index.refresh"):
+            added, removed = self._icon_index.refresh(changed)
+            self._icon_watcher.watch(self._icon_index.directories())
+        with self._icon_lock:
+            for name in removed:
+                del self._icon_dict[name]
+                self._fuzzy_index.remove(name)
+            for name, path in added.items():
+                if name not in self._icon_dict:
+                    self._fuzzy_index.add(name)
+                self._icon_dict[name] = path
+            if added or removed:
+                self._size_tables.clear()
+                self._icon_cache.clear()
+                self._fuzzy_cache.clear()
 
-        for path in glob.iglob("**/*.[ps][nv]g", recursive=True, root_dir="/usr/share/pixmaps"):
-            if os.path.isfile("/usr/share/pixmaps/" + path):
-                self._icon_dict[os.path.split(path)[1][:-4]] = f"/usr/share/pixmaps/{path}"
+    def _set_icons(self, icons: dict[str, str]):
+        table = IconTable(icons)
+        fuzzy_index = FuzzyIndex(table)
+        with self._icon_lock:
+            self._icon_dict = table
+            self._size_tables.clear()
+            self._fuzzy_index = fuzzy_index
+            self._icon_cache.clear()
+            self._fuzzy_cache.clear()
 
+    def _add_indexed_icons(self, icons: dict[str, str]):
+        with self._icon_lock:
+            self._icon_dict.update(icons)
 
+    def _ask_daemon(self, request: Callable[[IconClient], T]) -> T | None:
+        """
+        :returns: what request returned when called with the icon daemon, None if it isn't running or failed.
+         If it went away, the system-wide icons are indexed in-process from then on
+        """
+        daemon = self._daemon
+        if daemon is None:
+            return None
+        try:
+            return request(daemon)
+        except DaemonError as e:
+            print(f"ERROR: icon daemon error: {e}")
+            return None
+        except OSError as e:
+            with self._icon_lock:
+                lost, self._daemon = self._daemon is daemon, None
+            if lost:
+                print(f"ERROR: lost the icon daemon ({e}), indexing the system icons in-process")
+                daemon.close()
+                self._indexing = threading.Thread(target=self._load_icons, args=(False,), daemon=True)
+                self._indexing.start()
+            return None
+
+    def is_indexing(self) -> bool:
+        """
+        :returns: True while the icons are still being discovered in the background
+        """
+        return self._indexing.is_alive()
+
+    def wait_for_icons(self):
+        """
+        Blocks until the background icon discovery is finished
+        """
+        self._indexing.join()
+
+    def icon_count(self) -> int:
+        return len(self._icon_dict) + (self._ask_daemon(lambda daemon: daemon.count(self._icon_theme.name, self.icon_size)) or 0)
 
     def set_executable(self, file: str) -> bool:
         if os.path.isfile(file):
-            if os.access(file, os.X_OK):
-                self._executable = file
-            elif file.endswith("jar"):
-                self._executable = f"java -jar {file}"
-            elif file.endswith("py"):
-                self._executable = f"python {file}"
+            if executable_command(file):
+                self._executable = executable_command(file)
             else:
                 print(f"ERROR: '{file}' is not a valid file")
             return True
@@ -119,7 +318,7 @@ class Model:
         """
         Starts the process of installing the app.
         Raises FormError if the given data is invalid
-        May raise a subprocess.CalledProcessError if the implementation uses subprocess
+        May raise a subprocess.CalledProcessError if the implementation uses subprocess, or an OSError
         returns True if the installation was successful otherwise returns False
         """
         if not self._name:
@@ -127,53 +326,128 @@ class Model:
         if not self._executable:
             raise FormError("the executable file is invalid")
         print(self._name, self._executable, self._icon)
-        subprocess.run(
-            f"""~/bin/makelauncher "{self._name}" "{self._executable}" "{self._icon}" "{self._cateogry}\"""", 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            check=True
-            ).check_returncode()
+        install_launcher(self._name, self._executable, self._icon, self._cateogry)
         return True
 
 
-    def search_icon(self, name: str) -> list[tuple[str, str]]:
-        if name not in self._icon_cache:
-            self._icon_cache[name] = [(k,v) for k,v in self._icon_dict.items() if k.startswith(name)]
-        return self._icon_cache[name]
+    @traced("search_icon")
+    def search_icon(self, name: str) -> Sequence[tuple[str, str]]:
+        """
+        :returns: the (name, path) pairs of the icons starting with name, sorted by name
+        """
+        if not name:
+            return []
+        if self.is_indexing():
+            # partial results, not worth caching
+            with self._icon_lock:
+                result = sorted((k,v) for k,v in self._icon_dict.items() if k.startswith(name))
+        else:
+            # the watcher updates the indexes and clears the cache under the same lock
+            with self._icon_lock:
+                result = self._icon_cache.get(name)
+                profiler.count("search_cache.miss" if result is None else "search_cache.hit")
+                if result is None:
+                    result = self._icon_cache[name] = self._icon_dict.search(name)
+        shared = self._ask_daemon(lambda daemon: daemon.prefix(self._icon_theme.name, self.icon_size, [name]))
+        return result if shared is None else merge_prefix(result, shared[0], self._icon_theme.rank(self.icon_size))
     
+    @traced("fuzzy_search_icon")
+    def fuzzy_search_icon(self, name: str, limit: int = 50) -> list[tuple[str, str, float]]:
+        """
+        Ranked substring/subsequence search, "code" finds "visual-studio-code"
+        :returns: the best limit (name, path, score) triples, by decreasing score
+        """
+        if self.is_indexing():
+            with self._icon_lock:
+                icons = dict(self._icon_dict)
+            result = FuzzyIndex(icons).search(name, limit)
+        else:
+            with self._icon_lock:
+                result = self._fuzzy_cache.get((name, limit))
+                profiler.count("search_cache.miss" if result is None else "search_cache.hit")
+                if result is None:
+                    result = self._fuzzy_cache[(name, limit)] = self._fuzzy_index.search(name, limit)
+        shared = self._ask_daemon(lambda daemon: daemon.fuzzy(self._icon_theme.name, self.icon_size, [name], limit))
+        return result if shared is None else merge_fuzzy(result, shared[0], limit, self._icon_theme.rank(self.icon_size))
+
+    def get_icon_path(self, name: str, size: int) -> str | None:
+        """
+        :returns: the path of the best icon of the theme for size x size, None if there is no icon with that name.
+         The name -> path table of each size is computed once
+        """
+        if size == self.icon_size:
+            path = self._icon_dict.get(name)
+        else:
+            self.wait_for_icons()
+            with self._index_lock:
+                if size not in self._size_tables:
+                    self._size_tables[size] = IconTable(self._icon_index.to_dict(self._icon_theme.rank(size)))
+                path = self._size_tables[size].get(name)
+        paths = self._ask_daemon(lambda daemon: daemon.paths(self._icon_theme.name, size, [name]))
+        if paths and paths[0] is not None:
+            # the icon of the user only wins if the theme ranks it first, as without the daemon
+            rank = self._icon_theme.rank(size)
+            if path is None or rank(os.path.dirname(paths[0])) < rank(os.path.dirname(path)):
+                path = paths[0]
+        return path
+
+    def rebuild_icon_index(self) -> int:
+        """
+        Rescans every icon directory, ignoring the persisted index
+        :returns: the number of icons found
+        """
+        self.wait_for_icons()
+        with self._index_lock:
+            self._set_icons(self._icon_index.rebuild())
+            self._icon_watcher.watch(self._icon_index.directories())
+        return len(self._icon_dict)
+
     def set_icon(self, value: str):
-        if value in self._icon_dict:
+        if self.get_icon_path(value, self.icon_size) is not None:
             self._icon = value
             return True
         return False
     
     def add_icon(self, file: str) -> bool:
+        """
+        Copies file to ~/.icons and indexes it, rescanning that directory. Call it off the Tk main loop
+        """
         if not file.endswith(("png", "svg")):
             return False
         
-        shutil.copyfile(file, pathlib.Path(f"~/.icons/{os.path.split(file[1])}").expanduser())
-        for path in glob.iglob("*.[ps][nv]g", root_dir=f"/home/{getpass.getuser()}/.icons"):
-            if os.path.isfile(f"/home/{getpass.getuser()}/.icons/{path}"):
-                self._icon_dict[os.path.split(path)[1][:-4]] = f"/home/{getpass.getuser()}/.icons/{path}"
+        icons_dir = pathlib.Path("~/.icons").expanduser()
+        icons_dir.mkdir(exist_ok=True)
+        shutil.copyfile(file, icons_dir / os.path.basename(file))
+        with self._icon_lock:
+            # don't wait for the indexing: it applies the change once it is done
+            queued = self._pending_dirs is not None
+            if queued:
+                self._pending_dirs.add(str(icons_dir))
+        if not queued:
+            # the watcher would pick it up too, but the icon browser shows it right away
+            self._on_icon_dirs_changed({str(icons_dir)})
         return True
         
 
-    def get_png(self, absolute_path: str) -> str:
-        if not absolute_path.endswith("svg"):
-            return absolute_path
-        
-        if not os.path.isdir('/tmp/installer_script'):
-            os.makedirs('/tmp/installer_script')
+    def get_png(self, absolute_path: str, size: int = 32) -> str:
+        """
+        :returns: a png of the icon, svgs are rasterized at size x size
+        """
+        return self.get_pngs([absolute_path], size)[0]
 
-        new_path = "/tmp/installer_script/" + absolute_path.replace('/', '\\').removesuffix("svg") + "png"
-        if not os.path.exists(new_path):
-            cairosvg.svg2png(url=absolute_path, write_to=new_path)
-        
-        return new_path
+    def get_pngs(self, absolute_paths: list[str], size: int = 32) -> list[str]:
+        """
+        Same as get_png for several icons, the svgs are rasterized in parallel
+        """
+        shared = self._ask_daemon(lambda daemon: daemon.thumbnails(absolute_paths, size))
+        if shared is None:
+            return self._thumbnails.get_many(absolute_paths, size)
+        # the daemon only renders the system icons
+        local = iter(self._thumbnails.get_many([path for path, png in zip(absolute_paths, shared) if png is None], size))
+        return [png if png is not None else next(local) for png in shared]
     
     def get_categories(self) -> list[str]:
-        return ["Accesories", "Education", "Games", "Graphics", "Internet", "Office", "Other", "Programming", "SoundVideo", "Administration", "Preferences"]
+        return list(CATEGORIES)
     
     def add_category(self, value: str) -> bool:
         if (value in self.get_categories()) and (value not in self._cateogry.split(';')):
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+import contextlib
+from typing import Callable, Iterator, TypeVar
+
+F = TypeVar("F", bound=Callable)
+
+
+def _process_start() -> float:
+    """
+    :returns: when the interpreter started, on the time.perf_counter clock, from /proc with a 10 ms resolution.
+     The current time where /proc isn't available
+    """
+    now = time.perf_counter()
+    try:
+        with open("/proc/self/stat") as f:
+            # the fields after the command name, starttime is the 22nd field of the line
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return now
+    return now - max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class Profiler:
+    """
+    Opt-in timing spans and counters, written as a Chrome trace (chrome://tracing, ui.perfetto.dev) on exit.
+    Disabled, span() and count() return after a single attribute check.
+    """
+    def __init__(self):
+        self.enabled: bool = False
+        self.path: str = ""
+        self.counters: dict[str, int] = {}
+        self.last_ms: dict[str, float] = {}
+        self._events: list[dict] = []
+        self._lock = threading.Lock()
+        # the timestamps of the trace and of mark() count from the interpreter start
+        self._origin: float = _process_start()
+        self._pid: int = os.getpid()
+
+    def enable(self, path: str = "app-installer-trace.json"):
+        """
+        Starts recording, the trace is written to path when the program exits
+        """
+        if not self.enabled:
+            atexit.register(self.dump)
+        self.enabled = True
+        self.path = path
+        self._pid = os.getpid()
+
+    def span(self, name: str, **args) -> contextlib.AbstractContextManager:
+        """
+        Times the body of a with statement
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, args)
+
+    @contextlib.contextmanager
+    def _span(self, name: str, args: dict) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.last_ms[name] = (end - start) * 1000
+                self._events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                     "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6, "args": args})
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled or not n:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            self._events.append({"name": name, "ph": "C", "pid": os.getpid(), "ts": (time.perf_counter() - self._origin) * 1e6,
+                                 "args": {name: self.counters[name]}})
+
+    def mark(self, name: str):
+        """
+        Records an instant event, its time since the interpreter started is kept in last_ms
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self.last_ms[name] = (now - self._origin) * 1000
+            self._events.append({"name": name, "ph": "i", "s": "p", "pid": os.getpid(), "tid": threading.get_ident(),
+                                 "ts": (now - self._origin) * 1e6})
+
+    def elapsed_ms(self) -> float:
+        """
+        :returns: the time since the interpreter started, whether the profiler is enabled or not
+        """
+        return (time.perf_counter() - self._origin) * 1000
+
+    def stats_line(self) -> str:
+        """
+        :returns: a one line summary of the last spans and of the counters
+        """
+        with self._lock:
+            spans = " ".join(f"{name} {ms:.1f}ms" for name, ms in self.last_ms.items())
+            counters = " ".join(f"{name}={n}" for name, n in sorted(self.counters.items()))
+        return f"{spans} | {counters}"
+
+    def dump(self):
+        import multiprocessing
+        if os.getpid() != self._pid or multiprocessing.parent_process() is not None:
+            # a spawned thumbnail worker inherited APP_INSTALLER_PROFILE and enabled its own profiler,
+            # only the main process writes the trace
+            return
+        with self._lock:
+            trace = {"traceEvents": list(self._events), "displayTimeUnit": "ms", "otherData": {"counters": dict(self.counters)}}
+        try:
+            with open(self.path, "w") as f:
+                json.dump(trace, f)
+        except OSError as e:
+            print(f"ERROR: could not write the trace '{self.path}': {e}")
+
+
+_NO_SPAN = contextlib.nullcontext()
+profiler = Profiler()
+if os.environ.get("APP_INSTALLER_PROFILE"):
+    profiler.enable(os.environ["APP_INSTALLER_PROFILE"])
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """
+    Decorator recording every call of the function as a span of the profiler
+    """
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler._span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+import os
+import hashlib
+import pathlib
+import threading
+from icon_index import cache_dir
+from profiling import profiler
+
+
+def _render(source: str, destination: str, size: int) -> str | None:
+    """
+    Rasterizes an svg at size x size, runs in the pool processes
+    :returns: None, or why source couldn't be rendered
+    """
+    # unique per thread too, the daemon renders the requests of several clients in one process
+    tmp = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        import cairosvg
+        cairosvg.svg2png(url=source, write_to=tmp, output_width=size, output_height=size)
+        os.replace(tmp, destination)
+    except Exception as e:
+        # cairosvg raises anything from ValueError to xml errors on malformed files
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+class ThumbnailCache:
+    """
+    Persistent cache of svg icons rasterized at the size they are displayed.
+    Thumbnails are keyed by source path, source mtime and size, rendered across a process pool,
+    and the oldest ones are evicted once the cache grows over max_bytes.
+    """
+    def __init__(self, root: str | os.PathLike | None = None, max_bytes: int = 64 * 1024 * 1024, workers: int | None = None):
+        """
+        :param root: directory of the thumbnails, defaults to <cache_dir>/thumbnails
+        :param max_bytes: size budget of the directory
+        :param workers: size of the process pool, defaults to the number of cores
+        """
+        self.root = pathlib.Path(root) if root else cache_dir() / "thumbnails"
+        self.max_bytes = max_bytes
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    def path_for(self, source: str, size: int) -> str:
+        """
+        :returns: where the thumbnail of source is stored, whether it exists or not
+        """
+        key = f"{source}\0{os.stat(source).st_mtime_ns}\0{size}".encode()
+        return str(self.root / f"{hashlib.sha1(key).hexdigest()}.png")
+
+    def get(self, source: str, size: int) -> str:
+        """
+        :returns: the path of a png of source at size x size. Non svg sources are returned as is
+        """
+        return self.get_many([source], size)[0]
+
+    def get_many(self, sources: list[str], size: int) -> list[str]:
+        """
+        Renders the missing thumbnails of sources in parallel
+        :returns: the png of each source, in the same order. Sources that can't be rendered are returned as is
+        """
+        pngs: list[str] = []
+        missing: dict[str, str] = {}
+        svgs = 0
+        for source in sources:
+            if not source.endswith(".svg"):
+                pngs.append(source)
+                continue
+            svgs += 1
+            try:
+                png = self.path_for(source, size)
+            except OSError as e:
+                # removed since it was indexed
+                print(f"ERROR: could not render the icon '{source}': {e}")
+                pngs.append(source)
+                continue
+            if not os.path.exists(png):
+                missing[png] = source
+            pngs.append(png)
+        profiler.count("thumbnails.hit", svgs - len(missing))
+        if missing:
+            profiler.count("thumbnails.miss", len(missing))
+            self.root.mkdir(parents=True, exist_ok=True)
+            with profiler.span("get_png.rasterize", svgs=len(missing)):
+                if len(missing) == 1:
+                    (png, source), = missing.items()
+                    errors = [_render(source, png, size)]
+                else:
+                    errors = list(self._get_pool().map(_render, missing.values(), missing.keys(), [size] * len(missing)))
+            failed: dict[str, str] = {}
+            for (png, source), error in zip(missing.items(), errors):
+                if error is not None:
+                    print(f"ERROR: could not render the icon '{source}': {error}")
+                    failed[png] = source
+            pngs = [failed.get(png, png) for png in pngs]
+            self._added(png for png in missing if png not in failed)
+        return pngs
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries():
+                os.remove(entry.path)
+            self._size = 0
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        # multiprocessing is only imported once more than one svg has to be rendered
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with self._lock:
+            if self._pool is None:
+                # forking a process that runs Tk and worker threads is unsafe
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _entries(self) -> list[os.DirEntry]:
+        try:
+            with os.scandir(self.root) as it:
+                return [entry for entry in it if entry.name.endswith(".png")]
+        except FileNotFoundError:
+            return []
+
+    def _added(self, pngs):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry.stat().st_size for entry in self._entries())
+            else:
+                self._size += sum(os.path.getsize(png) for png in pngs)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # down to 3/4 of the budget so that eviction doesn't run on every render
+        entries = sorted(((entry.stat(), entry.path) for entry in self._entries()), key=lambda e: e[0].st_mtime_ns)
+        self._size = sum(stat.st_size for stat, _ in entries)
+        for stat, path in entries:
+            if self._size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= stat.st_size
@@ -1,9 +1,15 @@
 import customtkinter as ctk
-from typing import Callable, Self
-from model import Model, FormError, CinnamonDialogManager
+from typing import Any, Callable, Self
+from model import Model, FormError, get_dialog_manager
+from cache import LRUCache
+from profiling import profiler, traced
 from PIL import Image
 import subprocess
 import os
+import queue
+import tkinter
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 
@@ -13,6 +19,18 @@ import os
 
 
 
+def after_done(widget: tkinter.Misc, future: Future, callback: Callable[[Any], None], poll_ms: int = 50):
+    """
+    Calls callback with the result of future from the Tk main loop, once it is done. Cancelled futures are dropped
+    """
+    if future.cancelled():
+        return
+    if future.done():
+        callback(future.result())
+    else:
+        widget.after(poll_ms, after_done, widget, future, callback, poll_ms)
+
+
 class Colors:
     blue: str = "#1F6AA5"
     gray0: str = "gray5"
@@ -72,17 +90,23 @@ class EntryButtonFrame(ctk.CTkFrame):
 
 
 class SearchResult(ctk.CTkFrame):
-    image_cache: dict[str, Image.Image] = {}
+    # (icon path, display size) -> image already resized to the display size, ~8 bytes per pixel for the
+    # decoded image and its PhotoImage
+    image_cache: LRUCache[tuple[str, tuple[int, int]], ctk.CTkImage] = LRUCache(maxsize=4096, max_weight=32 * 1024 * 1024,
+                                                                                weigh=lambda image: 8 * image.cget("size")[0] * image.cget("size")[1])
     def __init__(self, master, width = 200, height = 200, corner_radius = None, border_width = None, bg_color = "transparent", fg_color = None, border_color = None, background_corner_colors = None, overwrite_preferred_drawing_method = None,
                     image_path: str = "", result_name: str = "", image_size: tuple[int, int] = (20, 20), hover_color: str | tuple[str, str] = None, callback: Callable[[str], None] = None, **kwargs):
         super().__init__(master, width, height, corner_radius, border_width, bg_color, fg_color, border_color, background_corner_colors, overwrite_preferred_drawing_method, **kwargs)
 
 
-        image = SearchResult.image_cache.get(image_path, Image.open(image_path))
-        self.name = result_name
-        self.image = ctk.CTkImage(light_image=image, dark_image=image, size=image_size)
-        self.image_label = ctk.CTkLabel(self, image=self.image, fg_color=fg_color, text="", height=height-4, corner_radius=corner_radius)
-        self.label = ctk.CTkLabel(self, fg_color=fg_color, text_color="white", text=result_name, height=height-4, corner_radius=corner_radius)
+        self.name = ""
+        self.image_path = ""
+        self.image_size = image_size
+        self.image: ctk.CTkImage | None = None
+        self.image_label = ctk.CTkLabel(self, fg_color=fg_color, text="", height=height-4, corner_radius=corner_radius)
+        self.label = ctk.CTkLabel(self, fg_color=fg_color, text_color="white", text="", height=height-4, corner_radius=corner_radius)
+        if image_path:
+            self.set_result(result_name, image_path, SearchResult.get_image(image_path, image_size))
         
         self.image_label.grid(row=0, padx=(8, 0), pady=(2, 3))
         self.label.grid(row=0, column=1, padx=(0, 8), pady=(2, 3))
@@ -97,15 +121,143 @@ class SearchResult(ctk.CTkFrame):
             self.configure(True, border_color=Colors.gray5, fg_color=fg_color)
         self.bind("<Enter>", on_focus)
         self.bind("<Leave>", on_leave)
-        self.bind("<Button-1>", lambda x: callback(result_name))
+        self.bind("<Button-1>", lambda x: callback(self.name))
         self.label.bind("<Enter>", on_focus)
         self.label.bind("<Leave>", on_leave)
-        self.label.bind("<Button-1>", lambda x: callback(result_name))
+        self.label.bind("<Button-1>", lambda x: callback(self.name))
         self.image_label.bind("<Enter>", on_focus)
         self.image_label.bind("<Leave>", on_leave)
-        self.image_label.bind("<Button-1>", lambda x: callback(result_name))
+        self.image_label.bind("<Button-1>", lambda x: callback(self.name))
+        profiler.count("widgets.created")
+
+    def destroy(self):
+        profiler.count("widgets.destroyed")
+        super().destroy()
+
+    def set_result(self, result_name: str, image_path: str, image: ctk.CTkImage | None = None):
+        """
+        Rebinds the row to another result, the widgets are reused
+        :param image: the icon of image_path, when it isn't ready yet it is set later with set_image
+        """
+        self.name = result_name
+        self.image_path = image_path
+        self.set_image(image)
+        self.label.configure(text=result_name)
+
+    def set_image(self, image: ctk.CTkImage | None):
+        self.image = image
+        self.image_label.configure(image=image)
+        if image is None:
+            # CTkLabel ignores image=None and would keep showing the icon of the previous result
+            self.image_label._label.configure(image="")
+
+    @staticmethod
+    def get_image(image_path: str, size: tuple[int, int], to_png: Callable[[str], str] = lambda path: path) -> ctk.CTkImage:
+        """
+        :returns: the image from image_cache, decoded and resized on a miss
+        """
+        image = SearchResult.image_cache.get((image_path, size))
+        profiler.count("image_cache.miss" if image is None else "image_cache.hit")
+        if image is None:
+            with Image.open(to_png(image_path)) as file:
+                thumbnail = file.convert("RGBA").resize(size, Image.LANCZOS)
+            image = SearchResult.image_cache[(image_path, size)] = ctk.CTkImage(light_image=thumbnail, dark_image=thumbnail, size=size)
+        return image
+
+class SearchPipeline:
+    """
+    Debounced search running off the Tk main loop.
+    A query is only started once no newer one was submitted for debounce_ms, every newer query cancels
+    the ones in flight and the result of the latest one is handed back to on_result from the main loop.
+    """
+    poll_ms: int = 15
+
+    def __init__(self, widget: tkinter.Misc, search: Callable[[str, Callable[[], bool]], Any],
+                 on_result: Callable[[str, Any], None], debounce_ms: int = 120):
+        """
+        :param widget: widget whose after() schedules the work
+        :param search: called from a worker thread with the query and a function returning True
+         once the query is stale. It should check it between expensive steps and return early
+        :param on_result: called from the main loop with the query and the return value of search
+        """
+        self.widget = widget
+        self.search = search
+        self.on_result = on_result
+        self.debounce_ms = debounce_ms
+        self._generation: int = 0
+        self._in_flight: int = 0
+        self._debounce_id: str | None = None
+        self._poll_id: str | None = None
+        self._results: queue.Queue[tuple[int, str, Any]] = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="icon-search")
+        self.closed: bool = False
+
+    def submit(self, query: str):
+        if self.closed:
+            return
+        self._generation += 1
+        if self._debounce_id is not None:
+            self.widget.after_cancel(self._debounce_id)
+        self._debounce_id = self.widget.after(self.debounce_ms, self._start, query, self._generation)
+
+    def run(self, task: Callable[[], Any], callback: Callable[[Any], None]):
+        """
+        Runs task in the worker, after the queries already started, and calls callback with its result from the main loop.
+        Dropped once the pipeline is closed
+        """
+        if self.closed:
+            return
+        after_done(self.widget, self._executor.submit(task), callback, self.poll_ms)
+
+    def close(self):
+        """
+        Cancels every pending query, to be called before the widget is destroyed
+        """
+        self.closed = True
+        self._generation += 1
+        for after_id in (self._debounce_id, self._poll_id):
+            if after_id is not None:
+                self.widget.after_cancel(after_id)
+        self._debounce_id = self._poll_id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _start(self, query: str, generation: int):
+        self._debounce_id = None
+        self._in_flight += 1
+        self._executor.submit(self._run, query, generation)
+        if self._poll_id is None:
+            self._poll_id = self.widget.after(self.poll_ms, self._poll)
+
+    def _run(self, query: str, generation: int):
+        result = None
+        try:
+            if generation == self._generation:
+                result = self.search(query, lambda: generation != self._generation)
+        finally:
+            self._results.put((generation, query, result))
+
+    def _poll(self):
+        self._poll_id = None
+        latest: tuple[str, Any] | None = None
+        while True:
+            try:
+                generation, query, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._in_flight -= 1
+            if generation == self._generation:
+                latest = (query, result)
+        if self._in_flight:
+            self._poll_id = self.widget.after(self.poll_ms, self._poll)
+        if latest is not None:
+            self.on_result(*latest)
+
 
 class IconTopLevel(ctk.CTkToplevel):    
+    max_results: int = 500
+    visible_rows: int = 5
+    debounce_ms: int = 120
+    image_size: int = 32
     def __init__(self, model: Model, *args, fg_color = Colors.gray2, callback: Callable[[str], None] = lambda x:x, **kwargs):
         super().__init__(*args, fg_color=fg_color, **kwargs)
 
@@ -115,51 +267,181 @@ class IconTopLevel(ctk.CTkToplevel):
         self.wm_title("Icon Browser")
         self.columnconfigure(0, weight=1)
         self.callback: Callable[[str], None] = lambda x: (callback(x), self.destroy())[0]
+        self.query: str = ""
+        self.results: list[tuple[str, str, float]] = []
+        self.offset: int = 0
 
         self.search_bar = EntryButtonFrame(self, width=180, height=20, border_color=Colors.gray5, entry_placeholder="discord", button_text="Add", button_callback=lambda *_:self.add_icon())
-        self.result_frame = ctk.CTkScrollableFrame(self,
-                                                     width=180,
-                                                     border_width=2,
-                                                     fg_color=Colors.gray3,
-                                                     border_color=Colors.gray5,
-                                                     label_fg_color=Colors.gray1,
-                                                     label_text="0 results ",
-                                                     label_text_color="white",
-                                                     label_font=ctk.CTkFont(size=15, slant='italic')
-                                                     )
+        self.result_frame = ctk.CTkFrame(self, width=180, border_width=2, fg_color=Colors.gray3, border_color=Colors.gray5)
+        self.result_label = ctk.CTkLabel(self.result_frame,
+                                         fg_color=Colors.gray1,
+                                         text="0 results ",
+                                         text_color="white",
+                                         font=ctk.CTkFont(size=15, slant='italic'),
+                                         corner_radius=5
+                                         )
+        self.scrollbar = ctk.CTkScrollbar(self.result_frame, command=self.scroll)
+        # a fixed pool of rows rebound to the visible slice of the results
+        self.rows: list[SearchResult] = [SearchResult(self.result_frame,
+                                                      width=160,
+                                                      height=20,
+                                                      corner_radius=10,
+                                                      border_width=2,
+                                                      fg_color=Colors.gray2,
+                                                      border_color=Colors.gray5,
+                                                      hover_color=Colors.gray1,
+                                                      image_size=(IconTopLevel.image_size, IconTopLevel.image_size),
+                                                      callback=self.callback
+                                                      ) for _ in range(IconTopLevel.visible_rows)]
+
+        self.result_frame.columnconfigure(0, weight=1)
+        self.result_label.grid(row=0, columnspan=2, padx=3, pady=3, sticky="we")
+        for i, row in enumerate(self.rows):
+            row.grid(row=i + 1, column=0, padx=(5, 0), pady=(5, 0), sticky="w")
+            row.grid_remove()
+        self.scrollbar.grid(row=1, column=1, rowspan=len(self.rows), padx=(0, 3), pady=(0, 3), sticky="ns")
+
+        for widget in (self.result_frame, *self.rows, *(row.label for row in self.rows), *(row.image_label for row in self.rows)):
+            widget.bind("<MouseWheel>", self.on_mouse_wheel)
+            widget.bind("<Button-4>", self.on_mouse_wheel)
+            widget.bind("<Button-5>", self.on_mouse_wheel)
+        self.search_pipeline = SearchPipeline(self, self.search, self.show_results, debounce_ms=IconTopLevel.debounce_ms)
         self.search_bar.entry.bind("<KeyRelease>", self.reconstruct_frame)
         self.search_bar.grid(pady=10)
         self.result_frame.grid(row=1, padx=25, sticky="nswe", pady=(0, 10))
+        self.stats_label: ctk.CTkLabel | None = None
+        if profiler.enabled:
+            # live profiling stats, see profiling.py
+            self.geometry("250x380")
+            self.stats_label = ctk.CTkLabel(self, text="", text_color=Colors.gray5, font=ctk.CTkFont(size=10), wraplength=230, justify="left")
+            self.stats_label.grid(row=2, padx=10, sticky="we")
+        self.indexing_poll_id: str | None = None
+        if self.model.is_indexing():
+            self.indexing_poll_id = self.after(500, self.poll_indexing)
+
+    def destroy(self):
+        self.search_pipeline.close()
+        if self.indexing_poll_id is not None:
+            self.after_cancel(self.indexing_poll_id)
+        super().destroy()
+
+    def poll_indexing(self):
+        self.reconstruct_frame()
+        self.indexing_poll_id = self.after(500, self.poll_indexing) if self.model.is_indexing() else None
 
     def add_icon(self):
-        file = CinnamonDialogManager().get_file(filters=(("Image (*.png, *.svg)", "*.png", "*.svg"),))
-        self.model.add_icon(file)
-        self.reconstruct_frame()
+        future = get_dialog_manager().get_file_async(filters=(("Image (*.png, *.svg)", "*.png", "*.svg"),))
+        after_done(self, future, self.add_icon_callback)
+
+    def add_icon_callback(self, file: str):
+        if not self.winfo_exists():
+            # the browser was closed while the dialog was open, the icon is added all the same
+            threading.Thread(target=self.model.add_icon, args=(file,), daemon=True).start()
+            return
+        # the copy and the rescan of ~/.icons run in the worker, the search that follows sees the icon
+        self.search_pipeline.run(lambda: self.model.add_icon(file), self.reconstruct_frame)
 
     def reconstruct_frame(self, event=None): 
-        search_result = self.model.search_icon(self.search_bar.entry.get())
-        self.result_frame.configure(label_text=f"{len(search_result)} results ")
-        
-        for widget in self.result_frame.children.values():
-            widget.pack_forget()
-        self.result_frame.children.clear()
-
-        for name, path in search_result:
-            SearchResult(self.result_frame,
-                        width=160,
-                        height=20,
-                        corner_radius=10,
-                        border_width=2,
-                        fg_color=Colors.gray2,
-                        border_color=Colors.gray5,
-                        hover_color=Colors.gray1,
-                        image_path=self.model.get_png(path),
-                        result_name=name,
-                        image_size=(32, 32),
-                        callback=self.callback
-                        ).pack(pady=(5, 0), anchor="w", expand=True)
-        
+        self.search_pipeline.submit(self.search_bar.entry.get())
+
+    @traced("icon_browser.search")
+    def search(self, query: str, cancelled: Callable[[], bool]) -> list[tuple[str, str, float]] | None:
+        """
+        Runs in the search pipeline worker: searches and rasterizes the thumbnails of the first two pages
+        """
+        results = self.model.fuzzy_search_icon(query, limit=IconTopLevel.max_results)
+        if cancelled():
+            return None
+        self.load_images([path for _, path, _ in results[:2 * len(self.rows)]])
+        return results
+
+    def load_images(self, paths: list[str]):
+        """
+        Runs in the search pipeline worker: rasterizes and decodes the icons into SearchResult.image_cache
+        """
+        size = (IconTopLevel.image_size, IconTopLevel.image_size)
+        # the decoded images already cached cost no stat nor daemon request
+        missing = [path for path in paths if (path, size) not in SearchResult.image_cache]
+        profiler.count("image_cache.hit", len(paths) - len(missing))
+        if not missing:
+            return
+        for path, png in zip(missing, self.model.get_pngs(missing, size=IconTopLevel.image_size)):
+            try:
+                SearchResult.get_image(path, size, lambda _: png)
+            except (OSError, ValueError) as e:
+                print(f"ERROR: could not load the icon '{path}': {e}")
+
+    @traced("icon_browser.show_results")
+    def show_results(self, query: str, results: list[tuple[str, str, float]] | None):
+        if results is None:
+            return
+        self.results = results
+        label_text = f"{len(self.results)} results "
+        if self.model.is_indexing():
+            label_text += f"(still indexing… {self.model.icon_count()} icons) "
+        self.result_label.configure(text=label_text)
+
+        if query != self.query:
+            self.query = query
+            self.offset = 0
+        self.offset = max(0, min(self.offset, len(self.results) - len(self.rows)))
+        self.refresh_rows()
+
+    @traced("icon_browser.refresh_rows")
+    def refresh_rows(self):
+        """
+        Rebinds the row pool to results[offset:offset+visible_rows]
+        """
+        size = (IconTopLevel.image_size, IconTopLevel.image_size)
+        missing: list[str] = []
+        for i, row in enumerate(self.rows):
+            if self.offset + i < len(self.results):
+                name, path, _ = self.results[self.offset + i]
+                row.set_result(name, path, SearchResult.image_cache.get((path, size)))
+                if row.image is None:
+                    missing.append(path)
+                row.grid()
+            else:
+                row.grid_remove()
+        if missing:
+            # thumbnails are rasterized off the main loop, the rows get their image once they are ready
+            self.search_pipeline.run(lambda: self.load_images(missing), self.show_images)
+        if self.results:
+            self.scrollbar.set(self.offset / len(self.results), min(1, (self.offset + len(self.rows)) / len(self.results)))
+        else:
+            self.scrollbar.set(0, 1)
+        if self.stats_label is not None:
+            self.stats_label.configure(text=profiler.stats_line())
+
+    def show_images(self, _=None):
+        if not self.winfo_exists():
+            return
+        size = (IconTopLevel.image_size, IconTopLevel.image_size)
+        for row in self.rows:
+            if row.image is None and row.image_path:
+                image = SearchResult.image_cache.get((row.image_path, size))
+                if image is not None:
+                    row.set_image(image)
+
+    def scroll_to(self, offset: int):
+        offset = max(0, min(offset, len(self.results) - len(self.rows)))
+        if offset != self.offset:
+            self.offset = offset
+            self.refresh_rows()
+
+    def scroll(self, action: str, amount: str, unit: str = "units"):
+        """
+        Scrollbar command, follows the tkinter yview protocol
+        """
+        if action == "moveto":
+            self.scroll_to(round(float(amount) * len(self.results)))
+        else:
+            step = len(self.rows) if unit == "pages" else 1
+            self.scroll_to(self.offset + step * (1 if float(amount) > 0 else -1))
 
+    def on_mouse_wheel(self, event):
+        self.scroll_to(self.offset + (-1 if event.num == 4 or event.delta > 0 else 1))
+        
 
 
 
@@ -171,6 +453,7 @@ class App(ctk.CTk):
         self.geometry("300x300")
         self.resizable(False, False)
         self.model = model
+        self.dialog_manager = get_dialog_manager()
 
         self.grid_columnconfigure(0, weight=1)
         # variables
@@ -255,10 +538,13 @@ class App(ctk.CTk):
         self.category_var.set(self.model.get_category())
     
     def exe_button_callback(self):
-        file = CinnamonDialogManager().get_file(filters=(
+        future = self.dialog_manager.get_file_async(filters=(
             ("Executables (*.exe, *.sh, *.zsh, *.jar, *.py)", '*.exe', '*.sh', '*.zsh', '*.jar', '*.py'),
             ("All files", '*')
         ))
+        after_done(self, future, self.exe_file_callback)
+
+    def exe_file_callback(self, file: str):
         if self.model.set_executable(file):
             self.executable_frame.entry.delete(0, 'end')
             self.executable_frame.entry.insert(0, file)
@@ -276,6 +562,8 @@ class App(ctk.CTk):
             self.error_label.configure(text=e, text_color="#f01a1a")
         except subprocess.CalledProcessError as e:
             self.error_label.configure(text=f"Installation error ({e.returncode}): {e.stderr} ", text_color="#f01a1a")
+        except OSError as e:
+            self.error_label.configure(text=f"Installation error: {e.strerror} ", text_color="#f01a1a")
         else:
             if success:
                 self.error_label.configure(text=f"{self.model.get_name()} was installed sucessfully!", text_color="green")